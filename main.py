@@ -2,13 +2,32 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
+import contextlib
+import copy
+import functools
+import glob
+import hashlib
+import pickle
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
 from datetime import date, datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 import google.generativeai as genai
-from io import StringIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+from io import BytesIO
 import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from streamlit_option_menu import option_menu
 
 st.set_page_config(page_title="Salud", layout="wide")
@@ -165,82 +184,990 @@ nav[class*="nav"] {
 """, unsafe_allow_html=True)
 
 REPO = "teresamattil/registro_salud"
-FILE = "comidas.csv"
-API_URL = f"https://api.github.com/repos/{REPO}/contents/{FILE}"
+FILE = "comidas.csv"      # histórico en un solo fichero (formato antiguo, se migra a PART_DIR)
+API_BASE = f"https://api.github.com/repos/{REPO}"
+BRANCH = "main"
+PART_DIR = "comidas"      # histórico compactado: un CSV por año + manifiesto
+MANIFEST = f"{PART_DIR}/manifest.json"
+VENTANA_RECIENTE = 90     # días de histórico que se cargan al arrancar; lo anterior, bajo demanda
+LOG_DIR = "comidas_log"   # altas pendientes de compactar en PART_DIR, un fichero por escritura
+NUTRI_FILE = "nutricion_cache.csv"   # memo descripción -> estimación de Gemini
+NUTRI_MAX = 2000          # entradas máximas del memo (se descartan las menos usadas)
+LOCAL_UMBRAL = 0.8        # similitud mínima para fiarse del estimador local sin preguntar a Gemini
+COMPACT_EVERY = 30        # nº de ficheros en LOG_DIR a partir del cual se compacta
+FLUSH_IDLE = 20           # s sin cambios antes de subir la cola de escritura
+REVALIDAR = 60            # s entre revalidaciones de las comidas contra GitHub
+GH_TIMEOUT = (5, 30)      # s de conexión / lectura por petición
+GH_INTENTOS = 3           # reintentos de un commit cuando la rama avanza por debajo
+SUEÑO_BLOQUE = 50_000     # filas por bloque al leer exportaciones de sueño grandes
 TOKEN = st.secrets["GITHUB_TOKEN"]
 GEMINI_KEY = st.secrets["GEMINI_API_KEY"]
 HEADERS = {"Authorization": f"token {TOKEN}"}
+CACHE_DIR = ".cache"   # espejo local de los ficheros del repo (ver _gh_fetch)
 objetivo = 1500  # Calorías diarias objetivo
 
+COLS_COMIDAS = ["id","Fecha","hora","comida","ruta_foto","calorías_estimadas",
+                "carbohidratos_g","proteinas_g","sodio_nivel"]
+
 genai.configure(api_key=GEMINI_KEY)
 model = genai.GenerativeModel("gemini-3-flash-preview")
+GEMINI_CHUNK_TOKENS = 1200   # tokens (aprox.) de comidas por llamada
+GEMINI_WORKERS = 4           # llamadas simultáneas a Gemini
+GEMINI_INTENTOS = 3          # intentos por trozo antes de darlo por fallido
+
+# ---------------- CACHÉS POR FUENTE ----------------
+# Cada función cacheada declara de qué ficheros de data/ depende; su mtime
+# entra en la clave, así que reemplazar un CSV solo recarga lo que lo usa.
+
+FUENTES = {   # fuente -> fichero local
+    "peso":    "data/peso_diario.csv",
+    "basal":   "data/basal_energy.csv",
+    "activo":  "data/active_energy.csv",
+    "sueño":   "data/sleep_time.csv",
+    "ciclo":   "data/ciclo.csv",
+}
 
-@st.cache_data(ttl=60)
-def load_data():
-    r = requests.get(API_URL, headers=HEADERS).json()
-    if "content" not in r:
-        return pd.DataFrame(columns=["Fecha","hora","comida","ruta_foto","calorías_estimadas",
-                                      "carbohidratos_g","proteinas_g","sodio_nivel"])
-    content = base64.b64decode(r["content"])
-    d = pd.read_csv(pd.io.common.BytesIO(content))
+def _version(*fuentes):
+    return tuple((f, os.path.getmtime(FUENTES[f]) if os.path.exists(FUENTES[f]) else None) for f in fuentes)
+
+def _cache(*fuentes, columnar=None, **kw):
+    """Como st.cache_data, pero versionada por el mtime de `fuentes`.
+
+    Con `columnar` (un esquema) el resultado va también a la caché columnar."""
+    def deco(fn):
+        if columnar is not None:
+            fn = _con_columnar(fn, fuentes, columnar)
+        cached = st.cache_data(**kw)(fn)
+        def wrapper(*args, **kwargs):
+            return cached(_version(*fuentes), *args, **kwargs)
+        return wrapper
+    return deco
+
+# ---------------- ESQUEMA Y CACHÉ COLUMNAR ----------------
+# Cada fuente ya parseada y tipada se guarda en COLUMNAR_DIR como Parquet con
+# el checksum de su origen en el nombre; un arranque en frío la lee de ahí.
+
+COLUMNAR_DIR = os.path.join(CACHE_DIR, "columnar")
+COLUMNAR_MAX = 64         # ficheros en COLUMNAR_DIR (se descartan los menos usados)
+ESQUEMA_VERSION = 1       # subir al cambiar los esquemas: invalida COLUMNAR_DIR
+FECHA = pd.ArrowDtype(pa.date32())
+TEXTO = pd.StringDtype("pyarrow")
+SODIO = pd.CategoricalDtype(["bajo", "medio", "alto"])
+
+ESQUEMA_COMIDAS = {
+    "id": TEXTO, "Fecha": FECHA, "hora": TEXTO, "comida": TEXTO, "ruta_foto": TEXTO,
+    "calorías_estimadas": "float64", "carbohidratos_g": "float32", "proteinas_g": "float32",
+    "sodio_nivel": SODIO,
+}
+ESQUEMA_FUENTES = {"Fecha": FECHA, "inicio": FECHA, "fin": FECHA}   # data/*.csv; el resto ya es numérico
+
+def _tipar(d, esquema):
+    """`d` con las columnas de `esquema` que tenga convertidas a su tipo; las demás no se tocan."""
+    cambios = {}
+    for col, tipo in esquema.items():
+        if col not in d.columns or d[col].dtype == tipo:
+            continue
+        s = d[col]
+        if tipo == FECHA:
+            s = pd.to_datetime(s, errors="coerce").dt.normalize().astype(FECHA)
+        elif isinstance(tipo, pd.CategoricalDtype):
+            # Un nivel inesperado se conserva como categoría más, no se pierde
+            otros = sorted(set(s.dropna().astype(str)) - set(tipo.categories))
+            s = s.astype(pd.CategoricalDtype(list(tipo.categories) + otros))
+        elif tipo == TEXTO:
+            s = s.astype(TEXTO)
+        else:
+            s = pd.to_numeric(s, errors="coerce").astype(tipo)
+        cambios[col] = s
+    return d.assign(**cambios) if cambios else d
+
+def _para_csv(d):
+    # float32 solo vive en memoria: al repo los macros van con su valor corto
+    # (4.8, no 4.800000190734863), también si un concat ya los pasó a float64
+    cols = [c for c, tipo in ESQUEMA_COMIDAS.items() if tipo == "float32" and c in d.columns]
+    return d.assign(**{c: pd.to_numeric(d[c], errors="coerce").astype("float32").astype(str).astype("float64")
+                       for c in cols})
+
+@st.cache_data(max_entries=32)
+def _sha_fichero(ruta, mtime):
+    with open(ruta, "rb") as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+def _columnar(clave, construir, esquema):
+    """`construir()` tipado con `esquema` y guardado en COLUMNAR_DIR.
+
+    `clave` ha de llevar el checksum del origen; mientras exista el fichero
+    se lee de ahí."""
+    firma = hashlib.sha1(repr(esquema).encode()).hexdigest()[:8]   # cambiar un esquema no lee Parquet viejos
+    ruta = os.path.join(COLUMNAR_DIR, f"{clave}-v{ESQUEMA_VERSION}-{firma}.parquet")
+    if os.path.exists(ruta):
+        try:
+            d = pq.read_table(ruta, memory_map=True).to_pandas(types_mapper={pa.string(): TEXTO}.get)
+            os.utime(ruta)   # cuenta como uso para el descarte
+            return _tipar(d, esquema)
+        except (OSError, pa.ArrowException):
+            pass   # escrito a medias o de otra versión de pyarrow: se rehace
+    d = _tipar(construir(), esquema).reset_index(drop=True)
+    os.makedirs(COLUMNAR_DIR, exist_ok=True)
+    tmp = f"{ruta}.{uuid.uuid4().hex}"
+    pq.write_table(pa.Table.from_pandas(d, preserve_index=False), tmp)
+    os.replace(tmp, ruta)
+    viejos = sorted((e for e in os.scandir(COLUMNAR_DIR) if e.name.endswith(".parquet")),
+                    key=lambda e: e.stat().st_mtime)[:-COLUMNAR_MAX]
+    for e in viejos:
+        with contextlib.suppress(FileNotFoundError):   # otro proceso pudo descartarlo antes
+            os.remove(e.path)
+    return d
+
+def _con_columnar(fn, fuentes, esquema):
+    # Cargador de data/*.csv cuyo resultado vive en la caché columnar (ver _cache)
+    @functools.wraps(fn)
+    def leer(version):
+        shas = [_sha_fichero(FUENTES[f], os.path.getmtime(FUENTES[f])) for f in fuentes]
+        return _columnar("-".join([fn.__name__, *shas]), lambda: fn(version), esquema)
+    return leer
+
+# ---------------- CLIENTE DE GITHUB ----------------
+
+class _GitHub:
+    """Cliente de la API de GitHub compartido por el servidor (pool, timeouts, reintentos)."""
+
+    def __init__(self):
+        self.s = requests.Session()
+        self.s.headers.update(HEADERS)
+        retry = Retry(total=4, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+        self.s.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=retry))
+        self.lock = threading.Lock()
+        self.metricas = {"peticiones": 0, "reintentos": 0, "conflictos": 0, "ms_ultima": None,
+                         "limite": None, "restantes": None, "reinicio": None}
+
+    def request(self, method, path, esperados=(), **kw):
+        """Petición a API_BASE/`path`; lanza HTTPError salvo 2xx/3xx o `esperados`."""
+        m = self.metricas
+        if m["restantes"] == 0 and m["reinicio"] and m["reinicio"] > time.time():
+            # Cuota agotada: ni lo intentamos (las lecturas tiran del espejo local)
+            raise requests.HTTPError(f"Límite de la API de GitHub agotado hasta {datetime.fromtimestamp(m['reinicio']):%H:%M}")
+        kw.setdefault("timeout", GH_TIMEOUT)
+        t0 = time.perf_counter()
+        r = self.s.request(method, f"{API_BASE}/{path}", **kw)
+        with self.lock:
+            m["peticiones"] += 1
+            m["ms_ultima"] = (time.perf_counter() - t0) * 1000
+            retries = getattr(r.raw, "retries", None)
+            if retries is not None:
+                m["reintentos"] += len(retries.history)
+            if "X-RateLimit-Remaining" in r.headers:
+                m["limite"] = int(r.headers["X-RateLimit-Limit"])
+                m["restantes"] = int(r.headers["X-RateLimit-Remaining"])
+                m["reinicio"] = int(r.headers["X-RateLimit-Reset"])
+        if r.status_code >= 400 and r.status_code not in esperados:
+            r.raise_for_status()
+        return r
+
+    def get(self, path, **kw):
+        return self.request("GET", path, **kw)
+
+    def post(self, path, **kw):
+        return self.request("POST", path, **kw)
+
+    def put(self, path, **kw):
+        return self.request("PUT", path, **kw)
+
+    def patch(self, path, **kw):
+        return self.request("PATCH", path, **kw)
+
+    def conflicto(self):
+        with self.lock:
+            self.metricas["conflictos"] += 1
+
+@st.cache_resource
+def _gh():
+    return _GitHub()
+
+# ---------------- ESPEJO LOCAL DEL REPO ----------------
+# Cada fichero descargado se guarda en CACHE_DIR junto a un .meta.json con su
+# ETag y su blob sha. Las lecturas siguientes mandan If-None-Match: si el
+# fichero no ha cambiado GitHub contesta 304 y se sirve el espejo.
+
+def _mirror_paths(path):
+    local = os.path.join(CACHE_DIR, path)
+    return local, local + ".meta.json"
+
+def _mirror_read(path):
+    local, meta_path = _mirror_paths(path)
+    if not (os.path.exists(local) and os.path.exists(meta_path)):
+        return None, None
+    with open(meta_path) as fh:
+        meta = json.load(fh)
+    with open(local, "rb") as fh:
+        return meta, fh.read()
+
+def _mirror_write(path, content, sha, etag=None):
+    local, meta_path = _mirror_paths(path)
+    os.makedirs(os.path.dirname(local), exist_ok=True)
+    # Sin meta el espejo no cuenta: se quita antes y se escribe el último, y
+    # cada fichero se reemplaza de golpe para no dejar nunca uno a medias
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for ruta, datos in ((local, content), (meta_path, json.dumps({"sha": sha, "etag": etag}).encode())):
+        tmp = f"{ruta}.{uuid.uuid4().hex}"
+        with open(tmp, "wb") as fh:
+            fh.write(datos)
+        os.replace(tmp, ruta)
+
+def _mirror_drop(path):
+    for f in _mirror_paths(path):
+        if os.path.exists(f):
+            os.remove(f)
+
+def _gh_blob(sha):
+    return _gh().get(f"git/blobs/{sha}", headers={"Accept": "application/vnd.github.raw"}).content
+
+def _gh_fetch(path, sha=None, estricto=False):
+    """(sha, bytes) de `path` en el repo, o (None, None) si no existe.
+
+    Con `estricto` un error de la API se lanza en vez de servir el espejo."""
+    meta, cached = _mirror_read(path)
+    if sha is not None:
+        if meta and meta["sha"] == sha:
+            return sha, cached
+        content = _gh_blob(sha)
+        _mirror_write(path, content, sha)
+        return sha, content
+    headers = {"If-None-Match": meta["etag"]} if meta and meta.get("etag") else {}
+    try:
+        r = _gh().get(f"contents/{path}", headers=headers, esperados=(404,))
+    except requests.RequestException:
+        if estricto:
+            raise
+        # Sin conexión, sin cuota o error de la API: mejor datos del espejo que nada
+        return (meta["sha"], cached) if meta else (None, None)
+    if r.status_code == 304:
+        return meta["sha"], cached
+    if r.status_code == 404:
+        return None, None
+    j = r.json()
+    etag = r.headers.get("ETag")
+    if meta and meta["sha"] == j["sha"]:
+        # Mismo blob que el espejo (p.ej. justo después de escribirlo): solo falta el ETag
+        _mirror_write(path, cached, j["sha"], etag)
+        return j["sha"], cached
+    if j.get("encoding") == "base64" and j.get("content"):
+        content = base64.b64decode(j["content"])
+    else:
+        # >1 MB: la API de contenidos ya no incluye el fichero, se pide el blob en crudo
+        content = _gh_blob(j["sha"])
+    _mirror_write(path, content, j["sha"], etag)
+    return j["sha"], content
+
+def _gh_list(dir_path, estricto=False):
+    """Lista [(path, sha)] de los CSV de un directorio del repo, revalidando con ETag."""
+    key = f"{dir_path}/.listado"
+    meta, cached = _mirror_read(key)
+    headers = {"If-None-Match": meta["etag"]} if meta and meta.get("etag") else {}
+    try:
+        r = _gh().get(f"contents/{dir_path}", headers=headers, esperados=(404,))
+    except requests.RequestException:
+        if estricto:
+            raise
+        r = None
+    if r is None:
+        entries = json.loads(cached) if meta else []
+    elif r.status_code == 304:
+        entries = json.loads(cached)
+    elif r.status_code == 404:
+        entries = []
+        _mirror_drop(key)
+    else:
+        entries = [[e["path"], e["sha"]] for e in r.json()
+                   if e.get("type") == "file" and e["name"].endswith(".csv")]
+        _mirror_write(key, json.dumps(entries).encode(), None, r.headers.get("ETag"))
+    return sorted((p, sha) for p, sha in entries)
+
+def _gh_commit(construir, message):
+    """Un único commit con los ficheros de `construir()` vía la API de Git Data.
+
+    `construir()` devuelve {path: bytes, o None para borrar}; si la rama avanza
+    se vuelve a construir sobre la nueva cabeza. Devuelve {path: sha}."""
+    gh = _gh()
+    for intento in range(GH_INTENTOS):
+        files = construir()
+        head = gh.get(f"git/ref/heads/{BRANCH}").json()["object"]["sha"]
+        base_tree = gh.get(f"git/commits/{head}").json()["tree"]["sha"]
+        tree, shas = [], {}
+        for path, content in files.items():
+            if content is None:
+                tree.append({"path": path, "mode": "100644", "type": "blob", "sha": None})
+                continue
+            blob = gh.post("git/blobs", json={
+                "content": base64.b64encode(content).decode(), "encoding": "base64"}).json()
+            tree.append({"path": path, "mode": "100644", "type": "blob", "sha": blob["sha"]})
+            shas[path] = blob["sha"]
+        new_tree = gh.post("git/trees", json={"base_tree": base_tree, "tree": tree}).json()["sha"]
+        commit = gh.post("git/commits", json={
+            "message": message, "tree": new_tree, "parents": [head]}).json()["sha"]
+        r = gh.patch(f"git/refs/heads/{BRANCH}", json={"sha": commit}, esperados=(409, 422))
+        if r.ok:
+            break
+        gh.conflicto()   # otro commit se coló entre medias
+    else:
+        r.raise_for_status()
+    for path, content in files.items():
+        if content is None:
+            _mirror_drop(path)
+        else:
+            _mirror_write(path, content, shas[path])
+    return shas
+
+def _ids_deterministas(d):
+    # Filas escritas antes de existir la columna id: id derivado del contenido y
+    # de la posición entre duplicados idénticos. Se persiste al compactar.
+    n = d.groupby(["Fecha", "hora", "comida"], dropna=False).cumcount().astype(str)
+    claves = d["Fecha"].astype(str) + "|" + d["hora"].astype(str) + "|" + d["comida"].astype(str) + "|" + n
+    return claves.map(lambda k: hashlib.sha1(k.encode()).hexdigest()[:12])
+
+def _nuevo_id():
+    return uuid.uuid4().hex[:12]
+
+def _parse_comidas(content):
+    d = pd.read_csv(BytesIO(content))
     for col in ["carbohidratos_g", "proteinas_g", "sodio_nivel"]:
         if col not in d.columns:
             d[col] = pd.NA
+    if "id" not in d.columns:
+        d["id"] = _ids_deterministas(d)
+    elif d["id"].isna().any():
+        d["id"] = d["id"].fillna(_ids_deterministas(d))
     return d
 
-def save_data(df, message):
-    r_api = requests.get(API_URL, headers=HEADERS).json()
-    sha = r_api["sha"]
-    content = base64.b64encode(df.to_csv(index=False).encode()).decode()
-    requests.put(API_URL, headers=HEADERS, json={"message": message, "content": content, "sha": sha})
+def _comidas_fichero(path, sha):
+    # Por sha del blob: mientras el fichero no cambie no se vuelve a leer el CSV ni a parsear
+    return _columnar(f"comidas-{sha}", lambda: _parse_comidas(_gh_fetch(path, sha)[1]), ESQUEMA_COMIDAS)
+
+def _aplicar_log(d, log):
+    """Aplica filas de log sobre `d`: upserts por id y bajas con borrado=1."""
+    if log is None or log.empty:
+        return d
+    log = log.drop_duplicates("id", keep="last").set_index("id")
+    baja = log["borrado"].fillna(0).astype(bool) if "borrado" in log.columns else pd.Series(False, index=log.index)
+    upd = _tipar(log.loc[~baja].reindex(columns=COLS_COMIDAS[1:]), ESQUEMA_COMIDAS)
+    d = d.set_index("id")
+    en_d = upd.index.intersection(d.index)
+    if len(en_d):
+        # Un nivel de sodio nuevo no cabría en las categorías de d; se vuelve a tipar al final
+        d = d.astype({"sodio_nivel": object})
+        d.loc[en_d, upd.columns] = upd.loc[en_d]
+    d = d.drop(index=log.index[baja], errors="ignore")
+    nuevas = upd.drop(index=en_d)
+    if len(nuevas):
+        d = pd.concat([d, nuevas]) if len(d) else nuevas
+    return _tipar(d.rename_axis("id").reset_index()[COLS_COMIDAS], ESQUEMA_COMIDAS)
+
+def _blob_sha(content):
+    # El mismo sha que calcula git: el manifiesto lo lleva sin haber subido el blob
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+def _manifiesto(estricto=False):
+    """(sha, {año: entrada}) del histórico compactado.
+
+    Sin manifiesto, FILE hace de partición única "*", que se carga siempre."""
+    sha, raw = _gh_fetch(MANIFEST, estricto=estricto)
+    if raw is not None:
+        return sha, json.loads(raw)["particiones"]
+    sha, _ = _gh_fetch(FILE, estricto=estricto)
+    return sha, ({} if sha is None else {"*": {"path": FILE, "sha": sha}})
+
+def _particionar(d):
+    """{path: bytes} con un CSV por año de Fecha más el manifiesto que los describe."""
+    f = pd.to_datetime(d["Fecha"], errors="coerce")
+    # Las filas sin fecha van con el último año
+    año = f.dt.year.fillna(f.dt.year.max() if f.notna().any() else date.today().year).astype(int)
+    ficheros, particiones = {}, {}
+    for a, g in d.groupby(año, sort=True):
+        path = f"{PART_DIR}/{a}.csv"
+        raw = _para_csv(g.reindex(columns=COLS_COMIDAS)).to_csv(index=False).encode()
+        fg = f.loc[g.index].dropna()
+        ficheros[path] = raw
+        particiones[str(a)] = {"path": path, "sha": _blob_sha(raw), "filas": len(g),
+                               "desde": f"{fg.min():%Y-%m-%d}" if len(fg) else None,
+                               "hasta": f"{fg.max():%Y-%m-%d}" if len(fg) else None}
+    ficheros[MANIFEST] = json.dumps({"particiones": particiones}, indent=1).encode()
+    return ficheros
+
+def _compactado(d, particiones, borrar=()):
+    """Ficheros de un commit que deja `d` como histórico compactado.
+
+    Solo se reescriben los años que cambian; se borran FILE y los de `borrar`."""
+    nuevos = _particionar(d)
+    viejos = {e["path"]: e["sha"] for e in particiones.values()}
+    ficheros = {path: raw for path, raw in nuevos.items()
+                if path == MANIFEST or viejos.get(path) != _blob_sha(raw)}
+    ficheros.update({path: None for path in viejos if path not in nuevos})
+    ficheros.update({path: None for path in borrar})
+    return ficheros
+
+def _recortar(d, cubierto):
+    # Las filas del log que caen en años aún sin cargar se quedan fuera de la vista
+    if cubierto is None:
+        return d
+    f = pd.to_datetime(d["Fecha"], errors="coerce")
+    dentro = f.isna() | (f >= pd.Timestamp(cubierto))
+    return d if dentro.all() else d[dentro].reset_index(drop=True)
+
+def _firma_remota(estricto=False):
+    # (sha del manifiesto, ficheros de LOG_DIR): identifica el estado de las comidas en GitHub
+    sha, particiones = _manifiesto(estricto)
+    return (sha, tuple(_gh_list(LOG_DIR, estricto))), particiones
+
+def _leer_comidas(firma=None, particiones=None, desde=None):
+    """Histórico desde el año de `desde` (None: todo) más el log de LOG_DIR.
+
+    Devuelve (comidas, cubierto): cubierto es el primer día cargado, o None
+    si está todo."""
+    if firma is None:
+        firma, particiones = _firma_remota()
+    _, log_files = firma
+    años = sorted(particiones)
+    cargar = [a for a in años if desde is None or a == "*" or int(a) >= desde.year]
+    cubierto = None if len(cargar) == len(años) else date(desde.year, 1, 1)
+    partes = [_comidas_fichero(particiones[a]["path"], particiones[a]["sha"]) for a in cargar]
+    partes = [x for x in partes if len(x)]
+    d = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=COLS_COMIDAS)
+    d = _tipar(d, ESQUEMA_COMIDAS)   # años con niveles de sodio distintos pierden la categoría al unirlos
+    log = [x for x in (_comidas_fichero(path, sha_d) for path, sha_d in log_files) if len(x)]
+    d = _aplicar_log(d, pd.concat(log, ignore_index=True) if log else None)
+    return _recortar(d, cubierto), cubierto
 
-@st.cache_data(ttl=3600)
-def load_peso():
+def load_data():
+    # Vista compartida por todas las sesiones (ver _AlmacenComidas); no modificar en sitio.
+    # Solo lleva el histórico reciente salvo que alguien haya pedido más (historia()).
+    return _almacen().frame()
+
+def save_log(log, message, ficheros=None):
+    """Sube las filas cambiadas como un fichero nuevo en LOG_DIR.
+
+    Con COMPACT_EVERY ficheros acumulados se compacta todo en PART_DIR;
+    `ficheros` ({path: bytes}) va en el mismo commit."""
+    ficheros = ficheros or {}
+    # Lecturas estrictas: con un histórico leído a medias la compactación borraría comidas
+    if len(_gh_list(LOG_DIR, estricto=True)) >= COMPACT_EVERY or "*" in _manifiesto(estricto=True)[1]:
+        def compactar():
+            # Se recalcula en cada intento: si la rama avanzó, sobre el estado nuevo.
+            # Las bajas y cambios pueden tocar cualquier año, así que aquí se lee todo.
+            firma, particiones = _firma_remota(estricto=True)
+            d = _aplicar_log(_leer_comidas(firma, particiones)[0], log)
+            return {**_compactado(d, particiones, [path for path, _ in firma[1]]), **ficheros}
+        _gh_commit(compactar, message)
+        return
+    path = f"{LOG_DIR}/{datetime.utcnow():%Y%m%dT%H%M%S%f}.csv"
+    raw = _para_csv(log.reindex(columns=COLS_COMIDAS + ["borrado"])).to_csv(index=False).encode()
+    if ficheros:
+        _gh_commit(lambda: {path: raw, **ficheros}, message)
+        return
+    r = _gh().put(f"contents/{path}", esperados=(422,), json={
+        "message": message, "content": base64.b64encode(raw).decode()})
+    if r.status_code == 422:
+        # Un reintento tras un 5xx puede encontrarse el fichero ya creado por el primer intento
+        if _gh_fetch(path, estricto=True)[1] != raw:
+            r.raise_for_status()
+        return
+    _mirror_write(path, raw, r.json()["content"]["sha"])
+
+def log_upsert(filas):
+    filas = filas.reindex(columns=COLS_COMIDAS).copy()
+    filas["id"] = filas["id"].astype(object)   # sin ids la columna llega como float
+    falta = filas["id"].isna()
+    filas.loc[falta, "id"] = [_nuevo_id() for _ in range(falta.sum())]
+    filas["borrado"] = 0
+    return filas
+
+def log_baja(ids):
+    return pd.DataFrame({"id": list(ids), "borrado": 1})
+
+# ---------------- ALMACÉN COMPARTIDO DE COMIDAS ----------------
+# Un único almacén por servidor guarda lo leído de GitHub y la cola de cambios
+# pendientes. Todas las sesiones leen la misma vista (remoto + cola), así que
+# N pestañas abiertas cuestan una revalidación cada REVALIDAR s, no N.
+# Los cambios se aplican a la vista al momento y suben en un solo commit tras
+# FLUSH_IDLE s sin cambios (o al pulsar "Sincronizar", o al parar el servidor).
+
+def _aplicar_ops(d, ops):
+    logs = [log for log, _ in ops if len(log)]
+    if not logs:
+        return d
+    return _aplicar_log(d, pd.concat(logs, ignore_index=True))
+
+def _subir_ops(ops, ficheros):
+    mensajes = pd.Series([m for _, m in ops]).value_counts(sort=False)
+    message = ", ".join(m if n == 1 else f"{m} (x{n})" for m, n in mensajes.items())
+    logs = [log for log, _ in ops if len(log)]
+    log = pd.concat(logs, ignore_index=True) if logs else log_baja([])
+    save_log(log.drop_duplicates("id", keep="last"), message, ficheros)
+
+def _huella(d):
+    return int(pd.util.hash_pandas_object(d.astype(str), index=False).sum()) if len(d) else 0
+
+class _AlmacenComidas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lectura = threading.Lock()  # una sola sesión revalida; el resto espera y reutiliza
+        self.subida = threading.Lock()   # una subida a la vez
+        self.leido = None                # (firma remota, desde) de lo que hay en remoto
+        self.remoto = None               # lo último leído de GitHub
+        self.desde = date.today() - timedelta(days=VENTANA_RECIENTE)   # histórico pedido (None = todo)
+        self.cubierto = None             # primera fecha cargada (None = todo el histórico)
+        self.vista = None                # remoto + en_vuelo + pendientes
+        self.revalidado = 0.0
+        self.version = 0                 # sube cada vez que cambia la vista
+        self.historial = deque(maxlen=200)   # [(versión, días tocados o None = todo)]
+        self.claves = np.array([], dtype="datetime64[D]")   # días de la vista, ordenados
+        self.orden = np.array([], dtype=int)             # posiciones en la vista en ese orden
+        self.totales = {}                # día (datetime64[D]) -> kcal del día
+        self.pendientes = []             # [(filas de log, mensaje)]
+        self.en_vuelo = []               # lo que se está subiendo ahora
+        self.ficheros = {}               # otros ficheros del repo que viajan en el mismo commit
+        self.ficheros_vuelo = {}
+        self.timer = None
+
+    def frame(self):
+        if self.vista is None or time.time() - self.revalidado > REVALIDAR:
+            self.refrescar()
+        return self.vista
+
+    def refrescar(self, forzar=False):
+        with self.lectura:
+            if not forzar and self.vista is not None and time.time() - self.revalidado <= REVALIDAR:
+                return
+            firma, particiones = _firma_remota()
+            desde = self.desde
+            if (firma, desde) == self.leido:
+                remoto, cubierto = self.remoto, self.cubierto
+            else:
+                remoto, cubierto = _leer_comidas(firma, particiones, desde)
+            with self.lock:
+                self.leido, self.remoto, self.cubierto = (firma, desde), remoto, cubierto
+                self.revalidado = time.time()
+                antes = self.vista
+                self.vista = _recortar(_aplicar_ops(remoto, self.en_vuelo + self.pendientes), cubierto)
+                if antes is None or _huella(antes) != _huella(self.vista):
+                    self._cambio(None)
+                else:
+                    self._indexar(None)   # mismo contenido, pero las filas pueden venir en otro orden
+
+    def historia(self, desde=None):
+        """Vista con el histórico cargado al menos desde `desde` (None: todo)."""
+        self.frame()
+        with self.lock:
+            falta = self.cubierto is not None and (desde is None or pd.Timestamp(desde) < pd.Timestamp(self.cubierto))
+            if falta:
+                self.desde = None if desde is None else min(self.desde, pd.Timestamp(desde).date())
+        if falta:
+            self.refrescar(forzar=True)
+        return self.vista
+
+    def _cambio(self, dias):
+        # Llamar con self.lock tomado; dias = fechas afectadas (None si no se sabe)
+        self.version += 1
+        self.historial.append((self.version, dias))
+        self._indexar(dias)
+
+    def _indexar(self, dias):
+        # Índice por día: orden estable (casi lineal tras un cambio pequeño) y
+        # totales de kcal recalculados solo para los días tocados
+        claves = pd.to_datetime(self.vista["Fecha"], errors="coerce").to_numpy("datetime64[D]")
+        self.orden = np.argsort(claves, kind="stable")
+        self.claves = claves[self.orden]
+        kcal = self.vista["calorías_estimadas"].to_numpy(float)[self.orden]
+        if dias is None:
+            validas = ~np.isnat(self.claves)
+            unicas, inicio = np.unique(self.claves[validas], return_index=True)
+            sumas = np.add.reduceat(kcal[validas], inicio) if len(unicas) else []
+            self.totales = dict(zip(unicas, sumas))
+            return
+        for d in dias:
+            k = np.datetime64(pd.Timestamp(d), "D")
+            lo, hi = np.searchsorted(self.claves, [k, k + 1])
+            if hi > lo:
+                self.totales[k] = kcal[lo:hi].sum()
+            else:
+                self.totales.pop(k, None)
+
+    def dia(self, fecha):
+        """(filas, kcal) de un día, por búsqueda binaria en el índice por fecha."""
+        self.historia(fecha)
+        with self.lock:
+            k = np.datetime64(pd.Timestamp(fecha), "D")
+            lo, hi = np.searchsorted(self.claves, [k, k + 1])
+            return self.vista.iloc[self.orden[lo:hi]], float(self.totales.get(k, 0.0))
+
+    def kcal_por_dia(self):
+        """Serie día -> kcal de todos los días con comidas, del índice por fecha."""
+        self.frame()
+        with self.lock:
+            return pd.Series(self.totales, dtype=float)
+
+    def cambios_desde(self, version):
+        """(versión, kcal por día, días tocados desde `version`).
+
+        Días es None si hay que reconstruirlo todo y entonces van todos los totales."""
+        self.frame()
+        with self.lock:
+            dias = set()
+            if version is None or (self.historial and self.historial[0][0] > version + 1):
+                dias = None
+            else:
+                for v, d in self.historial:
+                    if v > version:
+                        if d is None:
+                            dias = None
+                            break
+                        dias |= d
+            if dias is None:
+                return self.version, dict(self.totales), None
+            claves = {np.datetime64(pd.Timestamp(d), "D") for d in dias}
+            return self.version, {k: self.totales[k] for k in claves if k in self.totales}, dias
+
+    def encolar(self, log, mensaje, ficheros=None):
+        # Una fila con fecha de un año aún sin cargar trae ese año antes de aplicarse
+        fechas = pd.to_datetime(log["Fecha"], errors="coerce").dropna() if "Fecha" in log else []
+        if len(fechas):
+            self.historia(fechas.min())
+        else:
+            self.frame()
+        with self.lock:
+            self.pendientes.append((log, mensaje))
+            self.ficheros.update(ficheros or {})
+            # Días tocados: los nuevos de las filas y los que tenían antes esas ids
+            dias = set(log["Fecha"].dropna()) if "Fecha" in log else set()
+            dias |= set(self.vista.loc[self.vista["id"].isin(log["id"]), "Fecha"])
+            self.vista = _aplicar_log(self.vista, log)
+            self._cambio(dias)
+            self._programar()
+
+    def _programar(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(FLUSH_IDLE, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def n_pendientes(self):
+        with self.lock:
+            return len(self.en_vuelo) + len(self.pendientes)
+
+    def flush(self):
+        with self.subida:
+            with self.lock:
+                if not self.pendientes:
+                    return
+                self.en_vuelo, self.pendientes = self.pendientes, []
+                self.ficheros_vuelo, self.ficheros = self.ficheros, {}
+            try:
+                _subir_ops(self.en_vuelo, self.ficheros_vuelo)
+            except Exception:
+                with self.lock:
+                    self.pendientes = self.en_vuelo + self.pendientes
+                    self.ficheros = {**self.ficheros_vuelo, **self.ficheros}
+                    self.en_vuelo, self.ficheros_vuelo = [], {}
+                    self._programar()
+                raise
+            with self.lock:
+                self.remoto = _recortar(_aplicar_ops(self.remoto, self.en_vuelo), self.cubierto)
+                self.en_vuelo, self.ficheros_vuelo = [], {}
+                self.revalidado = 0.0    # la firma remota ha cambiado; la vista no
+
+@st.cache_resource
+def _almacen():
+    almacen = _AlmacenComidas()
+    atexit.register(almacen.flush)
+    return almacen
+
+# ---------------- CUBO DE EVOLUCIÓN ----------------
+# Agregados diarios, semanales (semana ISO, desde el lunes) y mensuales de kcal
+# y peso. Se construyen una vez por servidor y se ponen al día recalculando solo
+# los días que han cambiado y las semanas/meses que los contienen.
+
+class _CuboEvolucion:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None              # versión del almacén de comidas reflejada
+        self.peso = pd.Series(dtype=float)
+        self.kcal = pd.Series(dtype=float)
+        self.diario = pd.DataFrame({
+            "calorías_estimadas": pd.Series(dtype=float), "peso_kg": pd.Series(dtype=float),
+            "semana": pd.Series(dtype="datetime64[ns]"), "mes": pd.Series(dtype="datetime64[ns]"),
+        }, index=pd.DatetimeIndex([]))
+        self.niveles = {"semana": self.diario.iloc[:0, :2], "mes": self.diario.iloc[:0, :2]}
+
+    def _poner_dias(self, dias):
+        # Reescribe las filas diarias de `dias` y reagrupa solo sus semanas y meses
+        dias = pd.DatetimeIndex(sorted(dias))
+        nuevo = pd.DataFrame({
+            "calorías_estimadas": self.kcal.reindex(dias),
+            "peso_kg": self.peso.reindex(dias),
+        }, index=dias).dropna(how="all")
+        nuevo["semana"] = nuevo.index - pd.to_timedelta(nuevo.index.weekday, unit="D")
+        nuevo["mes"] = nuevo.index.to_period("M").to_timestamp()
+        viejo = self.diario.reindex(dias).dropna(how="all", subset=["semana"])
+        resto = self.diario.drop(dias, errors="ignore")
+        self.diario = (pd.concat([resto, nuevo]) if len(resto) else nuevo).sort_index()
+        for nivel in ("semana", "mes"):
+            tocados = pd.Index(nuevo[nivel]).union(pd.Index(viejo[nivel])).unique()
+            filas = self.diario[self.diario[nivel].isin(tocados)]
+            medias = filas.groupby(nivel)[["calorías_estimadas", "peso_kg"]].mean()
+            tabla = self.niveles[nivel].drop(tocados, errors="ignore")
+            self.niveles[nivel] = pd.concat([tabla, medias]).sort_index() if len(tabla) else medias
+
+    def sincronizar(self, almacen, peso):
+        with self.lock:
+            version, totales, dias = almacen.cambios_desde(self.version)
+            tocados = set()
+            if version != self.version:
+                kcal = pd.Series(totales, dtype=float)
+                kcal.index = pd.to_datetime(kcal.index)
+                if dias is None:
+                    tocados |= set(self.kcal.index)
+                    self.kcal = kcal.sort_index()
+                    tocados |= set(self.kcal.index)
+                else:
+                    dias = pd.to_datetime(pd.Index(list(dias)))
+                    partes = [x for x in (self.kcal.drop(dias, errors="ignore"), kcal) if len(x)]
+                    self.kcal = pd.concat(partes).sort_index() if partes else kcal
+                    tocados |= set(dias)
+                self.version = version
+            peso = peso.set_index(pd.to_datetime(peso["Fecha"]))["peso_kg"]
+            comun = peso.index.union(self.peso.index)
+            nuevo_p, viejo_p = peso.reindex(comun), self.peso.reindex(comun)
+            cambio = ~((nuevo_p == viejo_p) | (nuevo_p.isna() & viejo_p.isna()))
+            if cambio.any():
+                tocados |= set(comun[cambio])
+                self.peso = peso
+            if tocados:
+                self._poner_dias(tocados)
+            return self.diario, self.niveles
+
+@st.cache_resource
+def _cubo():
+    return _CuboEvolucion()
+
+# ---------------- MEMO DE ESTIMACIONES ----------------
+# Descripción normalizada -> (kcal, carbohidratos, proteínas, sodio) ya
+# estimados. Se consulta antes de llamar a Gemini y se guarda en el repo
+# (NUTRI_FILE) junto a las comidas, con como mucho NUTRI_MAX entradas.
+
+COLS_NUTRI = ["calorías_estimadas", "carbohidratos_g", "proteinas_g", "sodio_nivel"]
+
+def _normalizar(texto):
+    # "Café con leche " y "cafe con  leche" son la misma comida; las cantidades no se tocan
+    t = unicodedata.normalize("NFKD", str(texto).lower())
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w%]+", " ", t).split())
+
+class _MemoNutricion:
+    def __init__(self):
+        self.lock = threading.Lock()
+        _, content = _gh_fetch(NUTRI_FILE)
+        self.cubierto = None             # primera fecha de la vista sembrada (None: no hace falta ampliar)
+        if content is not None:
+            self.d = pd.read_csv(BytesIO(content)).set_index("clave")
+        else:
+            # Primera vez: se siembra con lo ya estimado en la vista cargada; _memo()
+            # añade los años anteriores si alguien llega a cargarlos
+            self.d = pd.DataFrame(columns=COLS_NUTRI + ["usado"]).rename_axis("clave")
+            almacen = _almacen()
+            self.sembrar(almacen.frame())
+            self.cubierto = almacen.cubierto
+        self._recortar()
+
+    def sembrar(self, d):
+        """Añade la última estimación de cada comida de `d` que aún no esté memorizada."""
+        ref = _referencias(d).set_index("clave")[COLS_NUTRI].assign(usado=0.0)
+        with self.lock:
+            nuevas = ref[~ref.index.isin(self.d.index)]
+            partes = [x for x in (self.d, nuevas) if len(x)]
+            self.d = pd.concat(partes) if partes else nuevas
+            self._recortar()
+
+    def _recortar(self):
+        if len(self.d) > NUTRI_MAX:
+            self.d = self.d.sort_values("usado").iloc[-NUTRI_MAX:]
+
+    def buscar(self, claves):
+        """Estimaciones memorizadas (COLS_NUTRI) de las `claves` que aciertan."""
+        with self.lock:
+            hit = claves[claves.isin(self.d.index)]
+            self.d.loc[hit.unique(), "usado"] = time.time()
+            return self.d.loc[hit.values, COLS_NUTRI].set_axis(hit.index)
+
+    def guardar(self, claves, est):
+        """Memoriza `est` (COLS_NUTRI) bajo `claves`, alineadas por índice."""
+        nuevas = est[COLS_NUTRI].set_axis(claves.loc[est.index].values)
+        nuevas = nuevas[~nuevas.index.duplicated(keep="last")].assign(usado=time.time())
+        with self.lock:
+            partes = [x for x in (self.d.drop(index=nuevas.index, errors="ignore"), nuevas) if len(x)]
+            self.d = pd.concat(partes) if partes else nuevas
+            self._recortar()
+
+    def a_csv(self):
+        with self.lock:
+            return _para_csv(self.d.rename_axis("clave").reset_index()).to_csv(index=False).encode()
+
+@st.cache_resource
+def _memo_base():
+    return _MemoNutricion()
+
+def _memo():
+    memo, almacen = _memo_base(), _almacen()
+    vista = almacen.frame()
+    if memo.cubierto is not None and almacen.cubierto != memo.cubierto:
+        memo.sembrar(vista)   # se han cargado años anteriores
+        memo.cubierto = almacen.cubierto
+    return memo
+
+# ---------------- ESTIMADOR LOCAL ----------------
+# Vecino más cercano por TF-IDF de n-gramas de caracteres (3 y 4) sobre las
+# comidas ya estimadas. Responde al instante y sin red cuando una comida nueva
+# se parece lo bastante (LOCAL_UMBRAL) a una conocida con las mismas cantidades
+# ("2 cervezas" nunca vale por "3 cervezas").
+
+def _ngramas(clave):
+    t = f" {clave} "
+    return [t[i:i + n] for n in (3, 4) for i in range(len(t) - n + 1)]
+
+def _referencias(d):
+    # Última estimación completa de cada descripción normalizada
+    d = d[(d["calorías_estimadas"] > 0) & d["carbohidratos_g"].notna()]
+    return d.assign(clave=d["comida"].map(_normalizar)).drop_duplicates("clave", keep="last")
+
+class _EstimadorLocal:
+    def __init__(self, d):
+        self.lock = threading.Lock()
+        ref = _referencias(d)
+        n_docs = len(ref)
+        df_ng = pd.Series([ng for c in ref["clave"] for ng in set(_ngramas(c))]).value_counts()
+        # IDF suavizado, congelado al construir; se reconstruye si el corpus crece mucho
+        self.idf = (np.log((1 + n_docs) / (1 + df_ng)) + 1).to_dict()
+        self.idf_nuevo = float(np.log(1 + n_docs) + 1)
+        self.n_base = max(n_docs, 1)
+        self.claves, self.valores, self.doc = [], [], {}
+        self.post = {}   # n-grama -> ([docs], [pesos])
+        self.añadir(ref)
+
+    def _vector(self, clave):
+        ng = pd.Series(_ngramas(clave)).value_counts()
+        w = ng * np.array([self.idf.get(g, self.idf_nuevo) for g in ng.index])
+        return w / np.sqrt((w ** 2).sum()) if len(w) else w
+
+    def añadir(self, filas):
+        """Incorpora filas estimadas (comida + COLS_NUTRI) sin reconstruir el índice."""
+        ref = _referencias(filas)
+        with self.lock:
+            for clave, vals in zip(ref["clave"], ref[COLS_NUTRI].itertuples(index=False, name=None)):
+                if clave in self.doc:
+                    self.valores[self.doc[clave]] = vals
+                    continue
+                i = self.doc[clave] = len(self.claves)
+                self.claves.append(clave)
+                self.valores.append(vals)
+                for g, w in self._vector(clave).items():
+                    docs, pesos = self.post.setdefault(g, ([], []))
+                    docs.append(i)
+                    pesos.append(w)
+
+    def crecido(self):
+        return len(self.claves) > 1.2 * self.n_base
+
+    def predecir(self, claves):
+        """Vecino más cercano de cada clave: COLS_NUTRI + similitud + vecino, con el índice de `claves`."""
+        filas = []
+        with self.lock:
+            for clave in claves:
+                scores = np.zeros(len(self.claves))
+                for g, qw in self._vector(clave).items():
+                    if g in self.post:
+                        docs, pesos = self.post[g]
+                        np.add.at(scores, docs, qw * np.asarray(pesos))
+                cifras = re.findall(r"\d+", clave)
+                i = next((int(j) for j in np.argsort(-scores)[:5]
+                          if scores[j] > 0 and re.findall(r"\d+", self.claves[j]) == cifras), None)
+                if i is None:
+                    filas.append((np.nan, np.nan, np.nan, None, 0.0, None))
+                else:
+                    filas.append((*self.valores[i], float(scores[i]), self.claves[i]))
+        return pd.DataFrame(filas, index=claves.index, columns=COLS_NUTRI + ["similitud", "vecino"])
+
+@st.cache_resource
+def _estimador_base():
+    return {"e": None, "cubierto": None}
+
+def _estimador():
+    # Se construye una vez por servidor con la vista cargada y se rehace cuando
+    # el corpus ha crecido >20 % o la vista trae años anteriores
+    ref, almacen = _estimador_base(), _almacen()
+    vista = almacen.frame()
+    if ref["e"] is None or ref["e"].crecido() or ref["cubierto"] != almacen.cubierto:
+        ref["e"], ref["cubierto"] = _EstimadorLocal(vista), almacen.cubierto
+    return ref["e"]
+
+@_cache("peso", ttl=3600, columnar=ESQUEMA_FUENTES)
+def load_peso(version):
     dp = pd.read_csv("data/peso_diario.csv")
-    dp["Date"] = pd.to_datetime(dp["Date"]).dt.date
+    dp["Date"] = pd.to_datetime(dp["Date"]).dt.normalize()
     dp = dp.groupby("Date", as_index=False)["Body mass(kg)"].mean()
     dp.columns = ["Fecha", "peso_kg"]
     return dp
 
-@st.cache_data(ttl=3600)
-def load_basal_energy():
+@_cache("peso", ttl=3600, columnar=ESQUEMA_FUENTES)
+def load_peso_mañana(version):
+    # Primera medición del día (mañana), que es la que usa el modelo
+    dp = pd.read_csv("data/peso_diario.csv")
+    dp["dt"] = pd.to_datetime(dp["Date"])
+    dp["Fecha"] = dp["dt"].dt.normalize()
+    return (dp.sort_values("dt")
+            .groupby("Fecha", as_index=False).first()
+            [["Fecha", "Body mass(kg)"]]
+            .rename(columns={"Body mass(kg)": "peso_kg"})
+            .sort_values("Fecha").reset_index(drop=True))
+
+@_cache("basal", ttl=3600, columnar=ESQUEMA_FUENTES)
+def load_basal_energy(version):
     d = pd.read_csv("data/basal_energy.csv")
-    d["Fecha"] = pd.to_datetime(d["Date"]).dt.date
+    d["Fecha"] = pd.to_datetime(d["Date"]).dt.normalize()
     d["basal_kcal"] = d["Basal energy burned(kcal)"]
     return d[["Fecha", "basal_kcal"]]
 
-@st.cache_data(ttl=3600)
-def load_active_energy():
+@_cache("activo", ttl=3600, columnar=ESQUEMA_FUENTES)
+def load_active_energy(version):
     d = pd.read_csv("data/active_energy.csv")
-    d["Fecha"] = pd.to_datetime(d["Date"]).dt.date
+    d["Fecha"] = pd.to_datetime(d["Date"]).dt.normalize()
     d["activo_kcal"] = pd.to_numeric(d["Active energy burned(kcal)"], errors="coerce")
     return d[["Fecha", "activo_kcal"]]
 
-@st.cache_data(ttl=3600)
-def load_sleep_data():
-    d = pd.read_csv("data/sleep_time.csv")
-    rows = []
-    for _, row in d.iterrows():
-        parts = str(row["Date"]).strip().split(" - ")
-        if len(parts) != 2:
-            continue
-        try:
-            end_dt = pd.to_datetime(parts[1])
-            horas = float(row["Time in bed(hr)"])
-        except Exception:
-            continue
-        if horas <= 1.0:
-            continue
-        rows.append({"Fecha": end_dt.date(), "horas_cama": horas})
-    if not rows:
+@_cache("sueño", ttl=3600, columnar=ESQUEMA_FUENTES)
+def load_sleep_data(version):
+    # Se agrega por bloques: nunca están en memoria todas las filas crudas
+    parciales = []
+    for d in pd.read_csv("data/sleep_time.csv", dtype=str, chunksize=SUEÑO_BLOQUE):
+        partes = d["Date"].str.strip().str.split(" - ")
+        # La fecha que cuenta es la del final, en hora local (se ignora el desfase)
+        fin = partes.where(partes.str.len() == 2).str[1]
+        fin = fin.str.replace(r"\s*[+-]\d{2}:?\d{2}$", "", regex=True)
+        fin = pd.to_datetime(fin, errors="coerce", format="mixed")
+        horas = pd.to_numeric(d["Time in bed(hr)"], errors="coerce")
+        ok = fin.notna() & (horas > 1.0)
+        if ok.any():
+            parciales.append(horas[ok].groupby(fin[ok].dt.normalize()).sum())
+    if not parciales:
         return pd.DataFrame(columns=["Fecha", "horas_cama"])
-    return pd.DataFrame(rows).groupby("Fecha", as_index=False)["horas_cama"].sum()
+    total = pd.concat(parciales).groupby(level=0).sum()
+    return total.rename_axis("Fecha").reset_index(name="horas_cama")
 
-@st.cache_data(ttl=3600)
-def load_ciclo():
+@_cache("ciclo", ttl=3600, columnar=ESQUEMA_FUENTES)
+def load_ciclo(version):
     d = pd.read_csv("data/ciclo.csv")
-    d["inicio"] = pd.to_datetime(d["Fecha_inicio_cliclo"], dayfirst=True).dt.date
-    d["fin"] = pd.to_datetime(d["Fecha_fin_ciclo"], dayfirst=True).dt.date
+    d["inicio"] = pd.to_datetime(d["Fecha_inicio_cliclo"], dayfirst=True)
+    d["fin"] = pd.to_datetime(d["Fecha_fin_ciclo"], dayfirst=True)
     d["dias_regla"] = pd.to_numeric(d["dias_periodo"], errors="coerce").fillna(5).astype(int)
     return d[["inicio", "fin", "dias_regla"]].dropna(subset=["inicio", "fin"])
 
@@ -257,20 +1184,487 @@ def _fase(fecha, ciclos):
                 return dia, 0, 0
     return np.nan, 0, 0
 
+def _fases(fechas, ciclos):
+    """Como _fase, pero para una columna de fechas entera de una pasada."""
+    fechas = pd.Series(fechas)
+    out = pd.DataFrame({"dia_ciclo": np.nan, "es_menstrual": 0, "es_lutea": 0}, index=fechas.index)
+    if ciclos.empty:
+        return out
+    ini = pd.to_datetime(ciclos["inicio"]).to_numpy("datetime64[D]")
+    fin = pd.to_datetime(ciclos["fin"]).to_numpy("datetime64[D]")
+    # Tramos sin solapes entre los inicios y finales de todos los ciclos: en cada
+    # uno manda el primer ciclo del fichero que lo cubre, como en _fase
+    cortes = np.unique(np.concatenate([ini, fin + 1]))
+    cubre = (cortes[:, None] >= ini) & (cortes[:, None] <= fin)
+    dueño = np.where(cubre.any(axis=1), cubre.argmax(axis=1), -1)
+    # Cada fecha, a su tramo por búsqueda binaria
+    f = pd.to_datetime(fechas).to_numpy("datetime64[D]")
+    k = np.searchsorted(cortes, f, side="right") - 1
+    j = dueño[k.clip(0)]
+    dentro = (k >= 0) & (j >= 0)
+    j = j.clip(0)
+    dia = (f - ini[j]) // np.timedelta64(1, "D") + 1
+    dur = (fin[j] - ini[j]) // np.timedelta64(1, "D") + 1
+    mens = dentro & (dia <= ciclos["dias_regla"].to_numpy()[j])
+    out["dia_ciclo"] = np.where(dentro, dia, np.nan)
+    out["es_menstrual"] = mens.astype(int)
+    out["es_lutea"] = (dentro & ~mens & (dia >= dur - 13)).astype(int)
+    return out
+
+def _observaciones(df_peso, df_master):
+    """Pares de pesadas consecutivas (1–7 días) con las medias del tramo entre ambas."""
+    p = df_peso.sort_values("Fecha").reset_index(drop=True)
+    dias = pd.to_datetime(p["Fecha"]).to_numpy("datetime64[D]")
+    gap = np.diff(dias).astype(int)
+    F = pd.to_datetime(df_master["Fecha"]).to_numpy("datetime64[D]")
+    lo = np.searchsorted(F, dias[:-1])
+    hi = np.searchsorted(F, dias[1:])
+    comida = (pd.to_numeric(df_master["kcal_total"], errors="coerce") > 0).to_numpy()
+
+    def _media(col, filas=None):
+        # Media de col en cada tramo, saltando NaN (como Series.mean)
+        v = pd.to_numeric(df_master[col], errors="coerce").to_numpy(float)
+        ok = ~np.isnan(v) if filas is None else filas & ~np.isnan(v)
+        suma = np.concatenate([[0.0], np.cumsum(np.where(ok, v, 0.0))])
+        cuenta = np.concatenate([[0], np.cumsum(ok)])
+        n = cuenta[hi] - cuenta[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(n > 0, (suma[hi] - suma[lo]) / np.maximum(n, 1), np.nan)
+
+    n_comida = np.concatenate([[0], np.cumsum(comida)])
+    dias_comida = n_comida[hi] - n_comida[lo]
+    valido = (gap >= 1) & (gap <= 7) & (dias_comida >= np.maximum(1, gap // 2))
+    peso = p["peso_kg"].to_numpy(float)
+    obs = pd.DataFrame({
+        "fecha": p["Fecha"].to_numpy()[1:],
+        "gap": gap,
+        "delta_dia": np.diff(peso) / np.where(gap == 0, 1, gap),
+        "superavit_medio":   _media("superavit", comida),
+        "alcohol_medio":     _media("kcal_alcohol", comida),
+        "carbs_medio":       _media("carbs_total", comida),
+        "sodio_alto_frac":   _media("sodio_alto_frac", comida),
+        "hora_ultima_media": _media("hora_ultima", comida),
+        "activo_medio":      _media("activo_kcal"),
+        "sueño_medio":       _media("horas_cama"),
+        "es_lutea":          _media("es_lutea"),
+        "es_menstrual":      _media("es_menstrual"),
+    })
+    return obs[valido].reset_index(drop=True)
+
+RIDGE_ALPHAS = np.logspace(-2, 3, 51)   # rejilla de regularización evaluada por GCV
+BOOT_N = 2000                            # remuestreos bootstrap para los intervalos del modelo
+SUBCONJUNTOS_CRECER = 0.05               # crecimiento de las observaciones que rehace los subconjuntos
+
+class _EstadisticosRidge:
+    """Estadísticos suficientes de una ridge: n, medias y co-momentos centrados.
+
+    Añadir filas es una actualización de rango bajo."""
+    def __init__(self, p, estado=None):
+        self.n = 0
+        self.mx, self.my = np.zeros(p), 0.0
+        self.cxx, self.cxy, self.cyy = np.zeros((p, p)), np.zeros(p), 0.0
+        if estado is not None:   # dict de vars() de otra instancia (p.ej. de un artefacto en disco)
+            self.__dict__.update(copy.deepcopy(estado))
+
+    def añadir(self, X, y):
+        X, y = np.atleast_2d(X).astype(float), np.atleast_1d(y).astype(float)
+        nb = len(y)
+        if nb == 0:
+            return
+        mxb, myb = X.mean(axis=0), y.mean()
+        dx, dy = mxb - self.mx, myb - self.my
+        k = self.n * nb / (self.n + nb)
+        self.cxx += (X - mxb).T @ (X - mxb) + k * np.outer(dx, dx)
+        self.cxy += (X - mxb).T @ (y - myb) + k * dx * dy
+        self.cyy += ((y - myb) ** 2).sum() + k * dy * dy
+        self.mx += dx * nb / (self.n + nb)
+        self.my += dy * nb / (self.n + nb)
+        self.n += nb
+
+    def estandarizacion(self):
+        sigma = np.sqrt(np.diag(self.cxx) / self.n)
+        sigma[sigma == 0] = 1.0
+        return self.mx.copy(), sigma
+
+    def ajustar(self, alphas=RIDGE_ALPHAS):
+        """Ajuste sobre las features estandarizadas, con alpha elegido por GCV en forma cerrada."""
+        alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+        mu, sigma = self.estandarizacion()
+        lam, V = np.linalg.eigh(self.cxx / np.outer(sigma, sigma))
+        lam = lam.clip(0)
+        b = V.T @ (self.cxy / sigma)
+        inv = 1.0 / (lam + alphas[:, None])                 # (alphas, componentes)
+        rss = self.cyy - 2 * (b ** 2 * inv).sum(axis=1) + (lam * b ** 2 * inv ** 2).sum(axis=1)
+        gcv = self.n * rss / (self.n - 1 - (lam * inv).sum(axis=1)) ** 2
+        i = int(np.argmin(gcv))
+        return {
+            "alpha": float(alphas[i]),
+            "w": np.concatenate([[self.my], V @ (b * inv[i])]),
+            "mu": mu, "sigma": sigma,
+            "gcv": gcv,   # alineado con alphas
+            "_V": V, "_inv": inv[i],
+        }
+
+    def diagnostico(self, fit, X, y):
+        """Ajustes y residuos leave-one-out exactos, (y_i - ŷ_i)/(1 - h_ii), de las filas X."""
+        Z = (X - fit["mu"]) / fit["sigma"]
+        y_hat = fit["w"][0] + Z @ fit["w"][1:]
+        h = 1.0 / self.n + ((Z @ fit["_V"]) ** 2) @ fit["_inv"]
+        return y_hat, y - (y - y_hat) / (1.0 - h)
+
+def _bootstrap_ridge(X, y, fit, n_boot=BOOT_N, semilla=0, previo=None):
+    """Pesos ridge de n_boot remuestreos, con el alpha y la estandarización de `fit`.
+
+    Bootstrap de Poisson: cada fila pesa Poisson(1) en cada remuestreo, con una
+    semilla propia de la fila, así que las sumas por remuestreo (`previo`, en
+    escala original) se amplían con las filas nuevas sin rehacer las demás.
+    Devuelve (matriz (n_boot, 1 + p), sumas)."""
+    q = X.shape[1] + 1
+    s = copy.deepcopy(previo) if previo else {
+        "n": 0, "G": np.zeros((n_boot, q, q)), "r": np.zeros((n_boot, q))}
+    if len(y) > s["n"]:
+        W = np.column_stack([np.random.default_rng([semilla, i]).poisson(1.0, n_boot)
+                             for i in range(s["n"], len(y))]).astype(float)
+        Xa = np.column_stack([np.ones(len(y) - s["n"]), X[s["n"]:]])
+        s["G"] += np.einsum("bn,ni,nj->bij", W, Xa, Xa, optimize=True)
+        s["r"] += np.einsum("bn,ni,n->bi", W, Xa, y[s["n"]:], optimize=True)
+        s["n"] = len(y)
+    # De la escala original a la estandarizada: Xs = [1, X] @ T
+    T = np.diag(np.r_[1.0, 1.0 / fit["sigma"]])
+    T[0, 1:] = -fit["mu"] / fit["sigma"]
+    A = T.T @ s["G"] @ T + fit["alpha"] * np.diag([0.0] + [1.0] * (q - 1))
+    return np.linalg.solve(A, (s["r"] @ T)[..., None])[..., 0], s
+
+def _buscar_subconjuntos(d, candidatas, alphas=RIDGE_ALPHAS):
+    """R² LOO de todos los subconjuntos no vacíos de `candidatas`, de mejor a peor."""
+    d = d[candidatas + ["delta_dia"]].dropna()
+    if len(d) < 10:
+        return pd.DataFrame(columns=["features", "n_features", "alpha", "r2_loo"])
+    X = d[candidatas].to_numpy(float)
+    y = d["delta_dia"].to_numpy(float)
+    n, p = X.shape
+    sigma = X.std(axis=0)
+    sigma[sigma == 0] = 1.0
+    Z = (X - X.mean(axis=0)) / sigma
+    yc = y - y.mean()
+    G, g = Z.T @ Z, Z.T @ yc
+    M = ((np.arange(1, 2 ** p)[:, None] >> np.arange(p)) & 1).astype(float)   # (subconjuntos, p)
+    lam, V = np.linalg.eigh(G * M[:, :, None] * M[:, None, :])
+    P = np.einsum("ni,si,sik->snk", Z, M, V, optimize=True)                   # Z_S·V, (s, n, p)
+    P2 = P ** 2
+    b = np.einsum("si,sik->sk", M * g, V)
+    # Un alpha cada vez: la memoria queda en O(subconjuntos × n × p)
+    r2 = np.empty((len(M), len(alphas)))
+    for a, alpha in enumerate(alphas):
+        inv = 1.0 / (lam.clip(0) + alpha)
+        ajuste = np.einsum("snk,sk->sn", P, b * inv)
+        h = 1.0 / n + np.einsum("snk,sk->sn", P2, inv)
+        r2[:, a] = 1.0 - (((yc - ajuste) / (1.0 - h)) ** 2).sum(axis=1) / (yc ** 2).sum()
+    j = r2.argmax(axis=1)
+    out = pd.DataFrame({
+        "features": [tuple(c for c, m in zip(candidatas, fila) if m) for fila in M],
+        "n_features": M.sum(axis=1).astype(int),
+        "alpha": alphas[j],
+        "r2_loo": r2[np.arange(len(M)), j],
+    })
+    return out.sort_values("r2_loo", ascending=False).reset_index(drop=True).assign(n=n)
+
+def _backtest(X, y, gaps, minimo=20, previo=None):
+    """Origen móvil: cada observación se predice con la ridge de las anteriores.
+
+    Devuelve (errores por horizonte, con el R² fuera de muestra en .attrs;
+    estado). Con el `estado` de una llamada anterior cuyas filas siguen al
+    principio de X, solo se predicen los orígenes nuevos."""
+    # X llega sin rellenar: los huecos se rellenan con la mediana de la ventana
+    # de entrenamiento, y los estadísticos salen de sumas que no dependen de ella
+    p = X.shape[1]
+    M = np.isnan(X).astype(float)
+    X0 = np.nan_to_num(X)
+    m = previo["t"] if previo else 0
+    if m and not (m <= len(y) and np.array_equal(previo["X"], X[:m], equal_nan=True)
+                  and np.array_equal(previo["y"], y[:m])):
+        previo, m = None, 0
+    s = copy.deepcopy(previo) if previo else dict(
+        sx0=np.zeros(p), sm=np.zeros(p), sy=0.0, syy=0.0, Gxx=np.zeros((p, p)), Gxm=np.zeros((p, p)),
+        Gmm=np.zeros((p, p)), bx=np.zeros(p), bm=np.zeros(p), filas=[])
+    filas = s["filas"]
+    for t in range(m, len(y)):
+        if t >= minimo:
+            c, vistas = np.zeros(p), M[:t].min(axis=0) < 1
+            c[vistas] = np.nanmedian(X[:t, vistas], axis=0)
+            mx, my = (s["sx0"] + s["sm"] * c) / t, s["sy"] / t
+            sxx = s["Gxx"] + s["Gxm"] * c[None, :] + c[:, None] * s["Gxm"].T + np.outer(c, c) * s["Gmm"]
+            stats = _EstadisticosRidge(p, dict(
+                n=t, mx=mx, my=my, cxx=sxx - t * np.outer(mx, mx),
+                cxy=s["bx"] + s["bm"] * c - t * mx * my, cyy=s["syy"] - t * my * my))
+            fit = stats.ajustar()
+            pred = fit["w"][0] + ((X0[t] + M[t] * c - fit["mu"]) / fit["sigma"]) @ fit["w"][1:]
+            filas.append((gaps[t], pred, y[t], my))
+        s["sx0"] += X0[t]; s["sm"] += M[t]; s["sy"] += y[t]; s["syy"] += y[t] ** 2
+        s["Gxx"] += np.outer(X0[t], X0[t]); s["Gxm"] += np.outer(X0[t], M[t])
+        s["Gmm"] += np.outer(M[t], M[t])
+        s["bx"] += X0[t] * y[t]; s["bm"] += M[t] * y[t]
+    s.update(t=len(y), X=X.copy(), y=y.copy())
+    d = pd.DataFrame(filas, columns=["horizonte", "pred", "real", "media_pasado"])
+    d["error_g"] = (d["pred"] - d["real"]) * d["horizonte"] * 1000
+    out = d.groupby("horizonte").agg(
+        n=("error_g", "size"),
+        mae_g=("error_g", lambda e: e.abs().mean()),
+        rmse_g=("error_g", lambda e: np.sqrt((e ** 2).mean())),
+    ).reindex(range(1, 8)).reset_index()
+    sse = ((d["real"] - d["pred"]) ** 2).sum()
+    sst = ((d["real"] - d["media_pasado"]) ** 2).sum()
+    out.attrs["r2"] = float(1.0 - sse / sst) if sst > 0 else np.nan
+    out.attrs["n"] = len(d)
+    return out, s
+
+def _escenarios(**ejes):
+    """Rejilla cartesiana de escenarios: una columna por eje, una fila por combinación."""
+    return pd.MultiIndex.from_product(list(ejes.values()), names=list(ejes)).to_frame(index=False)
+
+def _simular(mod, escenarios, fases, peso0):
+    """Trayectorias de peso (escenarios × días) con el modelo ajustado.
+
+    Las features de `escenarios` quedan fijas y las demás en su media histórica;
+    `fases` (salida de _fases) manda sobre es_lutea/es_menstrual."""
+    keys, mu, sigma, w = mod["feat_keys"], mod["mu"], mod["sigma"], mod["w"]
+    X = np.broadcast_to(mu, (len(escenarios), len(fases), len(keys))).copy()
+    for j, k in enumerate(keys):
+        if k in fases:
+            X[:, :, j] = fases[k].to_numpy(float)[None, :]
+        elif k in escenarios:
+            X[:, :, j] = escenarios[k].to_numpy(float)[:, None]
+    delta = w[0] + np.einsum("edp,p->ed", (X - mu) / sigma, w[1:])
+    return peso0 + np.cumsum(delta, axis=1)
+
+# ---------------- MODELO ----------------
+# activo_medio NO entra como predictor independiente: ya está restado dentro de superavit_medio.
+# Incluirlo dos veces crea multicolinealidad y el coeficiente aparece con signo incorrecto.
+FEAT_BASE = {
+    "superavit_medio": "Superávit calórico (kcal/día)",
+    "alcohol_medio":   "Calorías alcohol (kcal/día)",
+    "es_lutea":        "Fase lútea (fracción del período)",
+    "es_menstrual":    "Fase menstrual (fracción del período)",
+}
+# (feature, etiqueta, mínimo de períodos con dato para usarla, rellenar huecos con la mediana)
+FEAT_OPCIONALES = [
+    ("sueño_medio",       "Horas en cama (media del período)", 10, True),
+    ("carbs_medio",       "Carbohidratos (g/día)",             20, False),
+    ("sodio_alto_frac",   "Fracción días sodio alto",          20, False),
+    ("hora_ultima_media", "Hora última comida (media)",        10, True),
+]
+MODELO_VERSION = 11   # súbelo al cambiar _ajustar_modelo para invalidar los artefactos en disco
+
+def _ajustar_modelo(comidas, peso, basal, activo, sueño, ciclo, previo=None):
+    """Tabla diaria, observaciones y ajuste ridge.
+
+    Con `previo`, si sus observaciones siguen al principio de las nuevas, se
+    amplían sus estadísticos, bootstrap y backtest en vez de rehacerlos."""
+    _alc_kw = ["cerveza", "vino", "whiskey", "whisky", "gin", "ron", "vodka",
+               "copa", "caña", "cubata", "cava", "chupito", "jager", "tequila",
+               "licor", "vermut", "sidra"]
+    _df = comidas.copy()
+    _df["_alc"] = _df["comida"].str.lower().apply(lambda x: any(k in str(x) for k in _alc_kw))
+    _df["_kcal_alc"] = _df["calorías_estimadas"].where(_df["_alc"], 0.0)
+    _df["_carbs"] = pd.to_numeric(_df.get("carbohidratos_g", pd.Series(dtype=float)), errors="coerce")
+    # Sodio ponderado: "alto"=1.0, "medio"=0.5, "bajo"/otros=0.0.
+    # Antes solo se contaba "alto"; "medio" (300-700mg, ver prompt de
+    # estimación) quedaba igualado a "bajo". Ver vault/decisiones.md
+    # (modelado, 2026-07-19) para la comparación de R² LOO que justifica
+    # este cambio.
+    _sodio_niv = _df.get("sodio_nivel", pd.Series(dtype=str))
+    _df["_sodio_alto"] = np.select(
+        [_sodio_niv == "alto", _sodio_niv == "medio"],
+        [1.0, 0.5],
+        default=0.0,
+    )
+    _df["_sodio_valido"] = (_df.get("sodio_nivel", pd.Series(dtype=str)).notna() &
+                            (_df.get("sodio_nivel", pd.Series(dtype=str)) != "")).astype(float)
+    # Hora última comida: horas desde medianoche (0–24)
+    _df["_hora_num"] = pd.to_datetime(_df["hora"], format="%H:%M", errors="coerce").dt.hour + \
+                       pd.to_datetime(_df["hora"], format="%H:%M", errors="coerce").dt.minute / 60.0
+    df_food = _df.groupby("Fecha").agg(
+        kcal_total=("calorías_estimadas", "sum"),
+        kcal_alcohol=("_kcal_alc", "sum"),
+        carbs_total=("_carbs", "sum"),
+        sodio_alto_n=("_sodio_alto", "sum"),
+        sodio_n=("_sodio_valido", "sum"),
+        hora_ultima=("_hora_num", "max"),
+    ).reset_index()
+    df_food["sodio_alto_frac"] = df_food["sodio_alto_n"] / df_food["sodio_n"].replace(0, np.nan)
+
+    # ---- Tabla diaria maestra ----
+    df_base = (basal.merge(activo, on="Fecha", how="outer")
+        .merge(df_food, on="Fecha", how="left")
+        .merge(sueño, on="Fecha", how="left")
+        .sort_values("Fecha").reset_index(drop=True))
+
+    # Fase del ciclo para cada día
+    df_base[["dia_ciclo", "es_menstrual", "es_lutea"]] = _fases(df_base["Fecha"], ciclo)
+
+    # Huecos: con las medianas del ajuste anterior (congeladas) las filas ya
+    # vistas no cambian al llegar datos y sus estadísticos siguen valiendo
+    anteriores = previo.get("rellenos", {}) if previo else {}
+    frescos = {k: float(df_base[k].median()) for k in ("basal_kcal", "activo_kcal")}
+    rellenos = {k: anteriores.get(k, v) for k, v in frescos.items()}
+
+    def _tablas(valores):
+        master = df_base.copy()
+        master["gasto"] = (master["basal_kcal"].fillna(valores["basal_kcal"]) +
+                           master["activo_kcal"].fillna(valores["activo_kcal"]))
+        master["superavit"] = master["kcal_total"] - master["gasto"]
+        return master, _observaciones(peso, master)
+
+    # ---- Observaciones y selección de features ----
+    df_master, crudo = _tablas(rellenos)
+    res = {"df_master": df_master, "df_obs": crudo}
+    if crudo.empty:
+        return res
+    FEAT = dict(FEAT_BASE)
+    n_sueño = int(crudo["sueño_medio"].notna().sum())   # antes de rellenar huecos
+    for k, etiqueta, minimo, rellenar in FEAT_OPCIONALES:
+        if rellenar:
+            frescos[k] = float(crudo[k].median())
+            rellenos[k] = anteriores.get(k, frescos[k])
+        if crudo[k].notna().sum() >= minimo:
+            FEAT[k] = etiqueta
+    feat_keys = list(FEAT.keys())
+    opcionales = [k for k, _, _, rellenar in FEAT_OPCIONALES if rellenar]
+
+    def _muestra(obs, valores):
+        obs = obs.fillna({k: valores[k] for k in opcionales})
+        m = obs[feat_keys + ["delta_dia", "fecha", "gap"]].dropna(subset=feat_keys + ["delta_dia"])
+        return obs, m, m[feat_keys].to_numpy(float), m["delta_dia"].to_numpy(float)
+
+    df_obs, df_m, X, y = _muestra(crudo, rellenos)
+    n_prev = len(previo["y"]) if previo and "stats" in previo and previo["feat_keys"] == feat_keys else 0
+    if not (0 < n_prev <= len(y) and np.array_equal(previo["X"], X[:n_prev])
+            and np.array_equal(previo["y"], y[:n_prev])):
+        n_prev = 0
+        if rellenos != frescos:
+            # Sin nada que reutilizar, el relleno vuelve a las medianas actuales
+            rellenos = frescos
+            df_master, crudo = _tablas(rellenos)
+            df_obs, df_m, X, y = _muestra(crudo, rellenos)
+    res.update(df_master=df_master, df_obs=df_obs, rellenos=rellenos, n_previas=n_prev)
+    # Alternativa a los umbrales: todas las combinaciones de candidatas, por R² LOO
+    # Se repite cuando las observaciones han crecido un SUBCONJUNTOS_CRECER desde la última
+    if n_prev and len(df_obs) < (1 + SUBCONJUNTOS_CRECER) * previo["obs_subconjuntos"]:
+        subconjuntos, obs_sub = previo["subconjuntos"], previo["obs_subconjuntos"]
+    else:
+        subconjuntos = _buscar_subconjuntos(df_obs, list(FEAT_BASE) + [k for k, *_ in FEAT_OPCIONALES])
+        obs_sub = len(df_obs)
+    res.update(FEAT=FEAT, feat_keys=feat_keys, df_m=df_m, subconjuntos=subconjuntos,
+               obs_subconjuntos=obs_sub, n_sueño=n_sueño)
+    if len(df_m) < 10:
+        return res
+
+    # ---- Ridge regression (alpha elegido por GCV) ----
+    stats = _EstadisticosRidge(len(feat_keys), previo["stats"] if n_prev else None)
+    stats.añadir(X[n_prev:], y[n_prev:])
+    fit = stats.ajustar()
+    y_hat, y_loo = stats.diagnostico(fit, X, y)
+    ss_res = ((y - y_hat) ** 2).sum()
+    ss_tot = ((y - y.mean()) ** 2).sum()
+    # Bootstrap y backtest se amplían con las observaciones nuevas, como los estadísticos
+    w_boot, boot = _bootstrap_ridge(X, y, fit, previo=previo["boot"] if n_prev else None)
+    backtest, bt_estado = None, None
+    if len(y) > 30:
+        backtest, bt_estado = _backtest(crudo.loc[df_m.index, feat_keys].to_numpy(float), y,
+                                        df_m["gap"].to_numpy(), previo=previo["bt_estado"] if n_prev else None)
+    res.update(
+        stats=vars(stats), X=X, y=y, mu=fit["mu"], sigma=fit["sigma"],
+        alpha=fit["alpha"], w=fit["w"], y_hat=y_hat,
+        w_boot=w_boot, boot=boot, backtest=backtest, bt_estado=bt_estado,
+        r2=float(max(0.0, 1.0 - ss_res / ss_tot)),
+        rmse=float(np.sqrt(ss_res / len(y))),
+        # LOO analítico (R² real sobre datos no vistos)
+        r2_loo=float(max(0.0, 1.0 - ((y - y_loo) ** 2).sum() / ss_tot)),
+    )
+    return res
+
+@st.cache_resource(max_entries=4)
+def _modelo_guardado(clave, _fuentes):
+    # Artefactos en .cache/modelo/<clave>.pkl; solo se reajusta si no existen
+    ruta = os.path.join(CACHE_DIR, "modelo", f"{clave}.pkl")
+    if os.path.exists(ruta):
+        try:
+            with open(ruta, "rb") as fh:
+                return pickle.load(fh)
+        except Exception:
+            pass
+    # El último artefacto sirve de punto de partida si solo han llegado pesadas nuevas
+    previo = None
+    guardados = sorted(glob.glob(os.path.join(CACHE_DIR, "modelo", "*.pkl")), key=os.path.getmtime)
+    if guardados:
+        try:
+            with open(guardados[-1], "rb") as fh:
+                previo = pickle.load(fh)
+        except Exception:
+            previo = None
+        if not isinstance(previo, dict) or previo.get("version") != MODELO_VERSION:
+            previo = None
+    res = _ajustar_modelo(*_fuentes, previo=previo)
+    res["version"] = MODELO_VERSION
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = f"{ruta}.{uuid.uuid4().hex}"
+    with open(tmp, "wb") as fh:
+        pickle.dump(res, fh)
+    os.replace(tmp, ruta)
+    # Solo se conservan los últimos artefactos
+    viejos = sorted((e for e in os.scandir(os.path.dirname(ruta)) if e.name.endswith(".pkl")),
+                    key=lambda e: e.stat().st_mtime)[:-4]
+    for e in viejos:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(e.path)
+    return res
+
+def _modelo(comidas):
+    """Resultado de _ajustar_modelo, indexado por el contenido de las fuentes y las features."""
+    firma = hashlib.sha1()
+    firma.update(str(_huella(comidas)).encode())
+    for fuente in ("peso", "basal", "activo", "sueño", "ciclo"):
+        ruta = FUENTES[fuente]
+        firma.update(_sha_fichero(ruta, os.path.getmtime(ruta)).encode())
+    firma.update(repr((MODELO_VERSION, FEAT_BASE, FEAT_OPCIONALES, RIDGE_ALPHAS.tolist())).encode())
+    fuentes = (comidas, load_peso_mañana(), load_basal_energy(), load_active_energy(),
+               load_sleep_data(), load_ciclo())
+    return _modelo_guardado(firma.hexdigest(), fuentes)
+
 df = load_data()
-df["Fecha"] = pd.to_datetime(df["Fecha"]).dt.date
 
-def _run_estimacion(df_global):
-    """Llama a Gemini para estimar calorías y macros de las filas pendientes."""
-    pendientes = df_global[df_global["calorías_estimadas"] == 0.0].copy()
-    if pendientes.empty:
-        return df_global, 0
-    csv_text = pendientes.rename(columns={
-        "Fecha":"fecha","hora":"hora","comida":"descripcion","calorías_estimadas":"calorias"
-    })[["fecha","hora","descripcion","calorias"]].to_csv(index=False)
+@st.fragment(run_every=5)
+def _aviso_cambios():
+    # Si otra sesión (u otro dispositivo) ha cambiado las comidas, se repinta esta
+    _almacen().frame()   # revalida contra GitHub si toca, una vez por servidor
+    if st.session_state.get("_version_comidas") != _almacen().version:
+        st.rerun()
+
+st.session_state["_version_comidas"] = _almacen().version
+_aviso_cambios()
+
+_SCHEMA_ESTIMACION = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id":              {"type": "string"},
+            "calorias":        {"type": "number"},
+            "carbohidratos_g": {"type": "number"},
+            "proteinas_g":     {"type": "number"},
+            "sodio_nivel":     {"type": "string", "format": "enum", "enum": ["bajo", "medio", "alto"]},
+        },
+        "required": ["id", "calorias", "carbohidratos_g", "proteinas_g", "sodio_nivel"],
+    },
+}
+
+def _estimar_gemini(pendientes):
+    """Llama a Gemini para estimar calorías y macros; devuelve COLS_NUTRI indexado por id."""
+    items = pendientes[["id", "comida"]].rename(columns={"comida": "descripcion"}).to_json(
+        orient="records", force_ascii=False)
     prompt = f"""ROL: Eres un asistente nutricional especializado en estimación de alimentos consumidos en España.
-OBJETIVO: Para los ítems con calorias=0.0, estima simultáneamente calorías y macronutrientes.
-CAMPOS A ESTIMAR (solo donde calorias=0.0):
+OBJETIVO: Para cada ítem, estima simultáneamente calorías y macronutrientes de la porción descrita.
+CAMPOS A ESTIMAR:
 - calorias: kilocalorías totales de la porción
 - carbohidratos_g: carbohidratos totales en gramos
 - proteinas_g: proteínas en gramos
@@ -278,29 +1672,86 @@ CAMPOS A ESTIMAR (solo donde calorias=0.0):
   * bajo: <300mg sodio (frutas, verduras, café, pollo plancha, yogur, pescado fresco)
   * medio: 300-700mg (pan, queso fresco, huevos, plato casero normal, legumbres)
   * alto: >700mg (embutidos, jamón, quesos curados, patatas de bolsa, fast food, pizza, restaurante, precocinados, soja, aperitivos)
-FORMATO ENTRADA:
-{csv_text}
-FORMATO SALIDA: CSV con columnas: fecha,hora,descripcion,calorias,carbohidratos_g,proteinas_g,sodio_nivel
-Sin texto adicional. Solo el CSV."""
-    response = model.generate_content(prompt)
-    raw = re.sub(r"^```.*?\n|\n```$", "", response.text.strip(), flags=re.DOTALL)
-    df_est = pd.read_csv(StringIO(raw))
-    df_est.columns = ["Fecha","hora","comida","calorías_estimadas","carbohidratos_g","proteinas_g","sodio_nivel"]
-    df_est["Fecha"] = pd.to_datetime(df_est["Fecha"]).dt.date
-    df_est["carbohidratos_g"] = pd.to_numeric(df_est["carbohidratos_g"], errors="coerce")
-    df_est["proteinas_g"]     = pd.to_numeric(df_est["proteinas_g"],     errors="coerce")
-    keys = ["Fecha","hora","comida"]
-    df_out = df_global.merge(
-        df_est[keys + ["calorías_estimadas","carbohidratos_g","proteinas_g","sodio_nivel"]],
-        on=keys, how="left", suffixes=("","_new")
-    )
-    df_out["calorías_estimadas"] = df_out["calorías_estimadas_new"].fillna(df_out["calorías_estimadas"])
+ENTRADA (JSON):
+{items}
+SALIDA: un objeto por ítem de la entrada, conservando su id tal cual."""
+    response = model.generate_content(prompt, generation_config=genai.GenerationConfig(
+        response_mime_type="application/json", response_schema=_SCHEMA_ESTIMACION))
+    df_est = pd.DataFrame(json.loads(response.text)).rename(columns={"calorias": "calorías_estimadas"})
+    df_est = df_est.reindex(columns=["id"] + COLS_NUTRI)
+    for col in ["calorías_estimadas", "carbohidratos_g", "proteinas_g"]:
+        df_est[col] = pd.to_numeric(df_est[col], errors="coerce")
+    df_est["id"] = df_est["id"].astype(str)
+    est = df_est.dropna(subset=["id", "calorías_estimadas"]).drop_duplicates("id").set_index("id")
+    return est.loc[est.index.isin(pendientes["id"]), COLS_NUTRI]
+
+def _trocear(filas):
+    # Trozos de ~GEMINI_CHUNK_TOKENS tokens (≈4 caracteres por token + el envoltorio JSON de cada ítem)
+    coste = filas["comida"].astype(str).str.len() // 4 + 12
+    n_trozo = (coste.cumsum() // GEMINI_CHUNK_TOKENS).to_numpy()
+    return [t for _, t in filas.groupby(n_trozo, sort=True)]
+
+def _estimar_trozo(trozo):
+    for intento in range(GEMINI_INTENTOS):
+        try:
+            return _estimar_gemini(trozo)
+        except Exception:
+            if intento == GEMINI_INTENTOS - 1:
+                raise
+            time.sleep(2 ** intento)
+
+def _volcar_estimaciones(pendientes, est, memo, aprender=True):
+    # Upsert por id: solo viajan las filas estimadas (y el memo, en el mismo commit)
+    filas = pendientes.set_index("id").loc[est.index]
+    filas["calorías_estimadas"] = est["calorías_estimadas"].fillna(filas["calorías_estimadas"])
     for col in ["carbohidratos_g","proteinas_g","sodio_nivel"]:
-        df_out[col] = df_out[col+"_new"].combine_first(df_out[col])
-    df_out = df_out.drop(columns=[c for c in df_out.columns if c.endswith("_new")])
-    save_data(df_out, "Estimar calorías y macros")
-    st.cache_data.clear()
-    return df_out, len(pendientes)
+        filas[col] = est[col].where(est[col].notna(), filas[col])
+    if aprender:
+        _estimador().añadir(filas)
+    _almacen().encolar(log_upsert(filas.reset_index()), "Estimar calorías y macros",
+                       {NUTRI_FILE: memo.a_csv()})
+
+def _run_estimacion(df_global, progreso=None):
+    """Estima calorías y macros de las filas pendientes: memo, estimador local y Gemini.
+
+    Devuelve (df, nº filas estimadas, nº filas que se quedan sin estimar)."""
+    pendientes = df_global[df_global["calorías_estimadas"] == 0.0].copy()
+    if pendientes.empty:
+        return df_global, 0, 0
+    memo = _memo()
+    claves = pendientes["comida"].map(_normalizar).set_axis(pendientes["id"])
+    est = memo.buscar(claves)
+    n_ok = len(est)
+    if n_ok:
+        _volcar_estimaciones(pendientes, est, memo)
+    faltan = pendientes[~pendientes["id"].isin(est.index)]
+    if len(faltan):
+        # Lo que se parece mucho a algo ya estimado se resuelve sin red
+        local = _estimador().predecir(claves.loc[faltan["id"]])
+        local = local.loc[local["similitud"] >= LOCAL_UMBRAL, COLS_NUTRI]
+        if len(local):
+            _volcar_estimaciones(pendientes, local, memo, aprender=False)
+            n_ok += len(local)
+            faltan = faltan[~faltan["id"].isin(local.index)]
+    # A Gemini solo va una fila por descripción; el memo la reparte a sus repetidas
+    unicas = faltan[~claves.loc[faltan["id"]].duplicated().values]
+    trozos = _trocear(unicas) if len(unicas) else []
+    with ThreadPoolExecutor(GEMINI_WORKERS) as pool:
+        futuros = [pool.submit(_estimar_trozo, t) for t in trozos]
+        for i, fut in enumerate(as_completed(futuros), 1):
+            try:
+                nuevas = fut.result()
+            except Exception:
+                continue
+            memo.guardar(claves, nuevas)
+            de_este = claves.loc[faltan["id"]]
+            est = memo.buscar(de_este[de_este.isin(claves.loc[nuevas.index])])
+            n_ok += len(est)
+            if len(est):
+                _volcar_estimaciones(pendientes, est, memo)
+            if progreso:
+                progreso(i / len(trozos))
+    return load_data(), n_ok, len(pendientes) - n_ok
 
 # ---------------- MENU VISUAL ----------------
 
@@ -348,9 +1799,9 @@ if pagina == "Hoy":
     dia = st.date_input("Día", st.session_state.dia_seleccionado)
     st.session_state.dia_seleccionado = dia
 
-    # Datos del día
-    df_dia = df[df["Fecha"] == dia].copy()
-    consumidas = df_dia["calorías_estimadas"].sum()
+    # Datos del día (índice por fecha del almacén, sin recorrer todas las comidas)
+    df_dia, consumidas = _almacen().dia(dia)
+    df_dia = df_dia.copy()
     porcentaje = min(consumidas / objetivo, 1.0)
 
     st.markdown(f"**Calorías consumidas:** {consumidas} / {objetivo} kcal")
@@ -360,34 +1811,56 @@ if pagina == "Hoy":
       <div style="background:{color};width:{min(porcentaje,1)*100:.1f}%;height:20px;border-radius:6px;transition:width .3s"></div>
     </div>""", unsafe_allow_html=True)
 
-    # Tabla editable con checkbox para borrar
-    df_edit = df_dia[["Fecha", "hora", "comida", "calorías_estimadas"]].copy()
+    _n_pend = _almacen().n_pendientes()
+    if _n_pend:
+        _s_txt, _s_btn = st.columns([5, 2])
+        _s_txt.caption(f"{_n_pend} cambio(s) pendientes de subir a GitHub")
+        if _s_btn.button("Sincronizar", use_container_width=True):
+            try:
+                with st.spinner("Subiendo cambios…"):
+                    _almacen().flush()
+                st.rerun()
+            except requests.RequestException as e:
+                st.error(f"No se pudo subir a GitHub ({e}). Los cambios siguen en cola.")
+
+    # Tabla editable con checkbox para borrar (indexada por id, que no se muestra)
+    _cols_edit = ["Fecha", "hora", "comida", "calorías_estimadas"]
+    df_edit = df_dia.set_index("id")[_cols_edit].copy()
     df_edit.insert(0, "Borrar", False)
 
     edited = st.data_editor(
         df_edit,
         use_container_width=True,
         num_rows="fixed",
+        hide_index=True,
         key="editor_dia"
     )
 
     if st.button("Editar (borrar seleccionados)"):
-        idx_borrar = edited[edited["Borrar"]].index
-        if len(idx_borrar) == 0:
-            st.info("No has seleccionado ninguna fila")
+        ids_borrar = edited.index[edited["Borrar"]]
+        _quedan = edited.index.difference(ids_borrar)
+        ids_editar = _quedan[
+            (edited.loc[_quedan, _cols_edit].astype(str) != df_edit.loc[_quedan, _cols_edit].astype(str)).any(axis=1)
+        ]
+        if len(ids_borrar) == 0 and len(ids_editar) == 0:
+            st.info("No has seleccionado ni editado ninguna fila")
             st.stop()
 
-        # Eliminar del dataframe global usando los índices reales
-        df = df.drop(idx_borrar)
-        save_data(df, "Borrar comidas")
-
-        st.cache_data.clear()
+        if len(ids_editar):
+            filas = df_dia.set_index("id").loc[ids_editar]
+            filas[_cols_edit] = edited.loc[ids_editar, _cols_edit]
+            _almacen().encolar(log_upsert(filas.reset_index()), "Editar comidas")
+        if len(ids_borrar):
+            _almacen().encolar(log_baja(ids_borrar), "Borrar comidas")
         st.rerun()
 
     # ---- Añadir comida ----
     if "hora_seleccionada" not in st.session_state:
         st.session_state.hora_seleccionada = datetime.utcnow().time()
 
+    if "_aviso_local" in st.session_state:
+        st.toast(f"Estimado sin Gemini: {st.session_state.pop('_aviso_local')}")
+
     with st.form("add_food"):
         f = st.date_input("Fecha", st.session_state.dia_seleccionado)
         h = st.time_input("Hora", st.session_state.hora_seleccionada)
@@ -401,15 +1874,21 @@ if pagina == "Hoy":
             st.stop()
         st.session_state.hora_seleccionada = h
         new_row = {
+            "id": _nuevo_id(),
             "Fecha": f,
             "hora": h.strftime("%H:%M"),
             "comida": c,
             "calorías_estimadas": k
         }
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        save_data(df, "Añadir comida")
-
-        st.cache_data.clear()
+        if k == 0:
+            # Sin calorías: se rellenan al momento si hay una comida muy parecida ya estimada
+            p = _estimador().predecir(pd.Series([_normalizar(c)])).iloc[0]
+            if p["similitud"] >= LOCAL_UMBRAL:
+                new_row.update(p[COLS_NUTRI].to_dict())
+                st.session_state["_aviso_local"] = (
+                    f"{p['calorías_estimadas']:.0f} kcal, como «{p['vecino']}»"
+                )
+        _almacen().encolar(log_upsert(pd.DataFrame([new_row])), "Añadir comida")
         st.rerun()
 
 # ---------------- PÁGINA 2 ----------------
@@ -419,84 +1898,77 @@ elif pagina == "Registro":
     with _r_btn:
         st.write("")  # alinear verticalmente
         if st.button("Estimar calorías", use_container_width=True, type="primary"):
-            n_pend = (df["calorías_estimadas"] == 0.0).sum()
+            # Las pendientes pueden ser de años que la vista reciente no trae
+            _hist = _almacen().historia()
+            n_pend = (_hist["calorías_estimadas"] == 0.0).sum()
             if n_pend == 0:
                 st.toast("No hay entradas pendientes de estimar")
             else:
-                with st.spinner(f"Estimando {n_pend} entradas…"):
-                    df, n = _run_estimacion(df)
-                st.toast(f"{n} entradas estimadas")
+                _barra = st.progress(0.0, text=f"Estimando {n_pend} entradas…")
+                df, n, n_err = _run_estimacion(_hist, lambda f: _barra.progress(f, text=f"Estimando {n_pend} entradas…"))
+                st.toast(f"{n} entradas estimadas" +
+                         (f" · {n_err} sin estimar, vuelve a intentarlo" if n_err else ""))
                 st.rerun()
 
     dias_atras = st.slider("Últimos días", 7, 60, 30)
     hoy = date.today()
-    rango = [hoy - pd.Timedelta(days=i) for i in range(dias_atras)]
-
-    dias_con_datos = (
-        df.groupby("Fecha")["calorías_estimadas"]
-        .agg(n="count", kcal="sum")
-        .to_dict("index")
-    )
-
-    st.markdown("""
-    <style>
-    /* Registro: mantener columnas en fila en móvil */
-    [data-testid="stHorizontalBlock"] { flex-wrap: nowrap !important; gap: 4px !important; }
-    [data-testid="stHorizontalBlock"] > div { min-width: 0 !important; }
-    </style>""", unsafe_allow_html=True)
+    rango = pd.date_range(end=pd.Timestamp(hoy), periods=dias_atras)
+    kcal_dia = _almacen().kcal_por_dia().reindex(rango)
 
+    # Calendario en un solo gráfico: columnas = semanas, filas = días; tocar un día abre Hoy
     nombres_dia = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
+    _color = np.select([kcal_dia.isna(), kcal_dia > objetivo], ["#C6C6C8", "#FF3B30"], "#34C759")
+    _info = np.where(kcal_dia.isna(), "Sin datos",
+                     kcal_dia.fillna(0).astype(int).astype(str) + f" / {objetivo} kcal")
+    fig_cal = go.Figure(go.Scatter(
+        x=rango - pd.to_timedelta(rango.weekday, unit="D"), y=rango.weekday,
+        mode="markers+text", text=rango.day, textfont=dict(color="white", size=11),
+        marker=dict(symbol="square", size=30, color=_color),
+        customdata=np.stack([rango.strftime("%Y-%m-%d"), _info], axis=-1),
+        hovertemplate="%{customdata[0]}<br>%{customdata[1]}<extra></extra>",
+    ))
+    fig_cal.update_layout(
+        height=290, margin=dict(t=10, b=10, l=0, r=0), plot_bgcolor="white",
+        xaxis=dict(tickformat="%d %b", showgrid=False, zeroline=False, fixedrange=True),
+        yaxis=dict(tickvals=list(range(7)), ticktext=nombres_dia, autorange="reversed",
+                   showgrid=False, zeroline=False, fixedrange=True),
+        dragmode=False, clickmode="event+select",
+    )
+    _sel = st.plotly_chart(fig_cal, use_container_width=True, on_select="rerun",
+                           selection_mode="points", key="calendario_registro")
+    st.caption("Verde: por debajo del objetivo · Rojo: por encima · Gris: sin datos. Toca un día para abrirlo.")
+    if _sel and _sel["selection"]["points"]:
+        st.session_state.dia_seleccionado = date.fromisoformat(_sel["selection"]["points"][0]["customdata"][0])
+        st.session_state["nav_page"] = "Hoy"
+        st.rerun()
 
-    for dia_r in rango:
-        col1, col2, col3 = st.columns([3, 5, 1])
-        info = dias_con_datos.get(dia_r)
-        label = f"{nombres_dia[dia_r.weekday()]} {dia_r.strftime('%d %b')}"
-
-        with col1:
-            if info:
-                st.markdown(f'<span style="color:#34C759;font-size:10px;">●</span> **{label}**', unsafe_allow_html=True)
-            else:
-                st.markdown(f'<span style="color:#C6C6C8;font-size:10px;">●</span> **{label}**', unsafe_allow_html=True)
-        with col2:
-            if info:
-                _kcal = int(info["kcal"])
-                _pct  = min(_kcal / objetivo * 100, 100)
-                _over = _kcal > objetivo
-                _bar  = "#FF3B30" if _over else "#34C759"
-                _txt  = "#FF3B30" if _over else "#8E8E93"
-                st.markdown(f"""
-                <div style="margin-top:6px">
-                  <div style="background:#E5E5EA;border-radius:4px;height:5px;overflow:hidden">
-                    <div style="background:{_bar};width:{_pct:.1f}%;height:5px;border-radius:4px"></div>
-                  </div>
-                  <span style="font-size:11px;color:{_txt}">{_kcal} / {objetivo} kcal</span>
-                </div>""", unsafe_allow_html=True)
-            else:
-                st.caption("Sin datos")
-        with col3:
-            if st.button("Ir", key=f"ir_{dia_r}"):
-                st.session_state.dia_seleccionado = dia_r
-                st.session_state["nav_page"] = "Hoy"
-                st.rerun()
+    _gm = _gh().metricas
+    if _gm["restantes"] is not None:
+        st.caption(
+            f"API de GitHub: {_gm['restantes']}/{_gm['limite']} peticiones disponibles "
+            f"(se renueva a las {datetime.fromtimestamp(_gm['reinicio']):%H:%M}) · "
+            f"{_gm['peticiones']} peticiones, {_gm['reintentos']} reintentos y "
+            f"{_gm['conflictos']} conflictos resueltos desde el arranque · "
+            f"última {_gm['ms_ultima']:.0f} ms"
+        )
 
 # ---------------- PÁGINA 3 ----------------
 elif pagina == "Evolución":
     st.title("Evolución")
 
-    df_peso = load_peso()
-    df_cals = df.groupby("Fecha", as_index=False)["calorías_estimadas"].sum()
-
-    df_merged = (
-        pd.merge(df_cals, df_peso, on="Fecha", how="outer")
-        .sort_values("Fecha")
-        .reset_index(drop=True)
-    )
-    df_merged["Fecha"] = pd.to_datetime(df_merged["Fecha"])
-
     # ---- Selector de período ----
     PERIODOS = {"1S": 7, "1M": 30, "6M": 182, "1A": 365, "Todo": None}
     if "periodo_peso" not in st.session_state:
         st.session_state["periodo_peso"] = "1S"
+    periodo = st.session_state["periodo_peso"]
+    dias = PERIODOS[periodo]
+    hoy = pd.Timestamp(date.today())
+    desde = hoy - pd.Timedelta(days=dias) if dias else None
+
+    # Tablas diaria / semanal / mensual ya agregadas; cada vista es un corte.
+    # Los años de comidas que el período necesita (y su primera semana) se cargan ahora.
+    _almacen().historia(desde - pd.Timedelta(days=6) if desde is not None else None)
+    df_dia, _niveles = _cubo().sincronizar(_almacen(), load_peso())
 
     cols_p = st.columns(len(PERIODOS))
     for col, (label, _) in zip(cols_p, PERIODOS.items()):
@@ -509,10 +1981,7 @@ elif pagina == "Evolución":
                 st.session_state["periodo_peso"] = label
                 st.rerun()
 
-    periodo = st.session_state["periodo_peso"]
-    dias = PERIODOS[periodo]
-    hoy = pd.Timestamp(date.today())
-    df_v = df_merged[df_merged["Fecha"] >= hoy - pd.Timedelta(days=dias)].copy() if dias else df_merged.copy()
+    df_v = df_dia.loc[desde:, ["calorías_estimadas", "peso_kg"]].rename_axis("Fecha").reset_index()
 
     # ── Formateador de fechas en español (sin año) ──────────────────
     _DIAS_ES  = ["L", "M", "X", "J", "V", "S", "D"]
@@ -528,20 +1997,13 @@ elif pagina == "Evolución":
         df_plot["x_label"] = df_plot["x"].apply(_fmt_es)
         _x_ord = df_plot["x_label"].tolist()   # orden cronológico para el eje
         kcal_label = "Calorías"
-    elif periodo in ["6M", "1A"]:
-        df_v["x"] = df_v["Fecha"].dt.to_period("W").apply(lambda p: p.start_time)
-        df_plot = df_v.groupby("x", as_index=False).agg(
-            calorías_estimadas=("calorías_estimadas", "mean"),
-            peso_kg=("peso_kg", "mean"),
-        )
-        kcal_label = "Calorías medias (semana)"
     else:
-        df_v["x"] = df_v["Fecha"].dt.to_period("M").apply(lambda p: p.start_time)
-        df_plot = df_v.groupby("x", as_index=False).agg(
-            calorías_estimadas=("calorías_estimadas", "mean"),
-            peso_kg=("peso_kg", "mean"),
-        )
-        kcal_label = "Calorías medias (mes)"
+        # Semanas/meses enteros que se solapan con el período
+        nivel = "semana" if periodo in ["6M", "1A"] else "mes"
+        inicio = df_dia.loc[desde:, nivel].min()
+        tabla = _niveles[nivel].loc[inicio:] if pd.notna(inicio) else _niveles[nivel].iloc[:0]
+        df_plot = tabla.rename_axis("x").reset_index()
+        kcal_label = "Calorías medias (semana)" if nivel == "semana" else "Calorías medias (mes)"
 
     # ---- Métricas de resumen ----
     pesos_v = df_v.dropna(subset=["peso_kg"])
@@ -633,110 +2095,28 @@ elif pagina == "Modelo":
     with _m_btn:
         st.write("")
         if st.button("Actualizar", use_container_width=True):
-            st.cache_data.clear()
+            # Solo las comidas viven fuera; data/*.csv se recargan solos al cambiar su mtime
+            try:
+                _almacen().flush()
+            except requests.RequestException as e:
+                st.toast(f"No se pudo subir la cola a GitHub: {e}")
+            _almacen().refrescar(forzar=True)
             st.rerun()
 
-    # ---- Cargar fuentes ----
+    # ---- Cargar fuentes y modelo (en disco mientras no cambien) ----
+    df        = _almacen().historia()   # el modelo usa todo el histórico de comidas
+    df_peso   = load_peso_mañana()
     df_basal  = load_basal_energy()
     df_activo = load_active_energy()
     df_sleep  = load_sleep_data()
     df_ciclo  = load_ciclo()
+    _mod = _modelo(df)
+    df_master, df_obs = _mod["df_master"], _mod["df_obs"]
 
-    # Peso: primera medición del día (mañana)
-    dp_raw = pd.read_csv("data/peso_diario.csv")
-    dp_raw["dt"] = pd.to_datetime(dp_raw["Date"])
-    dp_raw["Fecha"] = dp_raw["dt"].dt.date
-    df_peso = (dp_raw.sort_values("dt")
-               .groupby("Fecha", as_index=False).first()
-               [["Fecha", "Body mass(kg)"]]
-               .rename(columns={"Body mass(kg)": "peso_kg"}))
-    df_peso = df_peso.sort_values("Fecha").reset_index(drop=True)
-
-    # ---- Comidas diarias: total + alcohol ----
-    _alc_kw = ["cerveza", "vino", "whiskey", "whisky", "gin", "ron", "vodka",
-               "copa", "caña", "cubata", "cava", "chupito", "jager", "tequila",
-               "licor", "vermut", "sidra"]
-    _df = df.copy()
-    _df["_alc"] = _df["comida"].str.lower().apply(lambda x: any(k in str(x) for k in _alc_kw))
-    _df["_kcal_alc"] = _df["calorías_estimadas"].where(_df["_alc"], 0.0)
-    _df["_carbs"] = pd.to_numeric(_df.get("carbohidratos_g", pd.Series(dtype=float)), errors="coerce")
-    # Sodio ponderado: "alto"=1.0, "medio"=0.5, "bajo"/otros=0.0.
-    # Antes solo se contaba "alto"; "medio" (300-700mg, ver prompt de
-    # estimación) quedaba igualado a "bajo". Ver vault/decisiones.md
-    # (modelado, 2026-07-19) para la comparación de R² LOO que justifica
-    # este cambio.
-    _sodio_niv = _df.get("sodio_nivel", pd.Series(dtype=str))
-    _df["_sodio_alto"] = np.select(
-        [_sodio_niv == "alto", _sodio_niv == "medio"],
-        [1.0, 0.5],
-        default=0.0,
-    )
-    _df["_sodio_valido"] = (_df.get("sodio_nivel", pd.Series(dtype=str)).notna() &
-                            (_df.get("sodio_nivel", pd.Series(dtype=str)) != "")).astype(float)
-    # Hora última comida: horas desde medianoche (0–24)
-    _df["_hora_num"] = pd.to_datetime(_df["hora"], format="%H:%M", errors="coerce").dt.hour + \
-                       pd.to_datetime(_df["hora"], format="%H:%M", errors="coerce").dt.minute / 60.0
-    df_food = _df.groupby("Fecha").agg(
-        kcal_total=("calorías_estimadas", "sum"),
-        kcal_alcohol=("_kcal_alc", "sum"),
-        carbs_total=("_carbs", "sum"),
-        sodio_alto_n=("_sodio_alto", "sum"),
-        sodio_n=("_sodio_valido", "sum"),
-        hora_ultima=("_hora_num", "max"),
-    ).reset_index()
-    df_food["sodio_alto_frac"] = df_food["sodio_alto_n"] / df_food["sodio_n"].replace(0, np.nan)
-
-    # ---- Tabla diaria maestra ----
-    df_e = df_basal.merge(df_activo, on="Fecha", how="outer")
-    df_e["gasto"] = (df_e["basal_kcal"].fillna(df_e["basal_kcal"].median()) +
-                     df_e["activo_kcal"].fillna(df_e["activo_kcal"].median()))
-
-    df_master = (df_e
-        .merge(df_food, on="Fecha", how="left")
-        .merge(df_sleep, on="Fecha", how="left")
-        .sort_values("Fecha").reset_index(drop=True))
-    df_master["superavit"] = df_master["kcal_total"] - df_master["gasto"]
-
-    # Fase del ciclo para cada día
-    _res = df_master["Fecha"].apply(lambda f: _fase(f, df_ciclo))
-    df_master["dia_ciclo"]    = [r[0] for r in _res]
-    df_master["es_menstrual"] = [r[1] for r in _res]
-    df_master["es_lutea"]     = [r[2] for r in _res]
-
-    # ---- Construir observaciones: pares de pesadas consecutivas ----
-    peso_s = df_peso.sort_values("Fecha").reset_index(drop=True)
-    obs = []
-    for i in range(len(peso_s) - 1):
-        r1, r2 = peso_s.iloc[i], peso_s.iloc[i + 1]
-        gap = (r2["Fecha"] - r1["Fecha"]).days
-        if not (1 <= gap <= 7):
-            continue
-        period = df_master[
-            (df_master["Fecha"] >= r1["Fecha"]) & (df_master["Fecha"] < r2["Fecha"])
-        ]
-        dias_comida = (period["kcal_total"].fillna(0) > 0).sum()
-        if dias_comida < max(1, gap // 2):
-            continue
-        food_rows = period[period["kcal_total"].notna() & (period["kcal_total"] > 0)]
-        obs.append({
-            "fecha": r2["Fecha"],
-            "delta_dia": (r2["peso_kg"] - r1["peso_kg"]) / gap,
-            "superavit_medio":   food_rows["superavit"].mean() if not food_rows.empty else np.nan,
-            "alcohol_medio":     food_rows["kcal_alcohol"].mean() if not food_rows.empty else 0.0,
-            "carbs_medio":       food_rows["carbs_total"].mean() if not food_rows.empty else np.nan,
-            "sodio_alto_frac":   food_rows["sodio_alto_frac"].mean() if not food_rows.empty else np.nan,
-            "hora_ultima_media": food_rows["hora_ultima"].mean() if not food_rows.empty else np.nan,
-            "activo_medio":      period["activo_kcal"].mean(),
-            "sueño_medio":       period["horas_cama"].mean(),
-            "es_lutea":          period["es_lutea"].mean(),
-            "es_menstrual":      period["es_menstrual"].mean(),
-        })
-
-    df_obs = pd.DataFrame(obs)
     if df_obs.empty:
         st.warning("No hay suficientes datos para construir el modelo.")
         _d1, _d2, _d3, _d4, _d5, _d6 = st.columns(6)
-        _d1.metric("comidas.csv", len(df))
+        _d1.metric("comidas", len(df))
         _d2.metric("peso_diario.csv", len(df_peso))
         _d3.metric("basal_energy.csv", len(df_basal))
         _d4.metric("active_energy.csv", len(df_activo))
@@ -744,39 +2124,12 @@ elif pagina == "Modelo":
         _d6.metric("ciclo.csv", len(df_ciclo))
         st.stop()
 
-    # ---- Selección de features ----
-    # activo_medio NO entra como predictor independiente: ya está restado dentro de superavit_medio.
-    # Incluirlo dos veces crea multicolinealidad y el coeficiente aparece con signo incorrecto.
-    FEAT = {
-        "superavit_medio": "Superávit calórico (kcal/día)",
-        "alcohol_medio":   "Calorías alcohol (kcal/día)",
-        "es_lutea":        "Fase lútea (fracción del período)",
-        "es_menstrual":    "Fase menstrual (fracción del período)",
-    }
-    n_sueño = df_obs["sueño_medio"].notna().sum()
-    if n_sueño >= 10:
-        df_obs["sueño_medio"] = df_obs["sueño_medio"].fillna(df_obs["sueño_medio"].median())
-        FEAT["sueño_medio"] = "Horas en cama (media del período)"
-    n_carbs = df_obs["carbs_medio"].notna().sum()
-    if n_carbs >= 20:
-        FEAT["carbs_medio"] = "Carbohidratos (g/día)"
-    n_sodio = df_obs["sodio_alto_frac"].notna().sum()
-    if n_sodio >= 20:
-        FEAT["sodio_alto_frac"] = "Fracción días sodio alto"
-    n_hora = df_obs["hora_ultima_media"].notna().sum()
-    if n_hora >= 10:
-        df_obs["hora_ultima_media"] = df_obs["hora_ultima_media"].fillna(df_obs["hora_ultima_media"].median())
-        FEAT["hora_ultima_media"] = "Hora última comida (media)"
-
-    feat_keys = list(FEAT.keys())
-    df_m = df_obs[feat_keys + ["delta_dia", "fecha"]].dropna(
-        subset=feat_keys + ["delta_dia"]
-    )
+    FEAT, feat_keys, df_m, n_sueño = _mod["FEAT"], _mod["feat_keys"], _mod["df_m"], _mod["n_sueño"]
 
     if len(df_m) < 10:
         st.warning(f"Solo {len(df_m)} observaciones completas. Añade más días con datos de comida.")
         _d1, _d2, _d3, _d4, _d5, _d6 = st.columns(6)
-        _d1.metric("comidas.csv", len(df))
+        _d1.metric("comidas", len(df))
         _d2.metric("peso_diario.csv", len(df_peso))
         _d3.metric("basal_energy.csv", len(df_basal))
         _d4.metric("active_energy.csv", len(df_activo))
@@ -785,41 +2138,14 @@ elif pagina == "Modelo":
         _d1.metric("Obs. modelo (df_obs)", len(df_obs))
         st.stop()
 
-    # ---- Ridge regression (alpha=2.0 para estabilizar coeficientes de ciclo) ----
-    X = df_m[feat_keys].values.astype(float)
-    y = df_m["delta_dia"].values.astype(float)
-
-    mu    = X.mean(axis=0)
-    sigma = X.std(axis=0)
-    sigma[sigma == 0] = 1.0
-    Xs = np.column_stack([np.ones(len(X)), (X - mu) / sigma])
-
-    alpha_r = 2.0
-    I_reg = np.diag([0.0] + [1.0] * len(feat_keys))
-
-    def _ridge(Xs_, y_, alpha_):
-        A = Xs_.T @ Xs_ + alpha_ * np.diag([0.0] + [1.0] * (Xs_.shape[1] - 1))
-        return np.linalg.solve(A, Xs_.T @ y_)
-
-    w = _ridge(Xs, y, alpha_r)
-    y_hat  = Xs @ w
-    ss_res = ((y - y_hat) ** 2).sum()
-    ss_tot = ((y - y.mean()) ** 2).sum()
-    r2     = float(max(0.0, 1.0 - ss_res / ss_tot))
-    rmse   = float(np.sqrt(ss_res / len(y)))
-
-    # LOO cross-validation (R² real sobre datos no vistos)
-    y_loo = np.zeros(len(y))
-    for _i in range(len(y)):
-        _mask = np.ones(len(y), dtype=bool); _mask[_i] = False
-        _w = _ridge(Xs[_mask], y[_mask], alpha_r)
-        y_loo[_i] = Xs[_i] @ _w
-    r2_loo = float(max(0.0, 1.0 - ((y - y_loo)**2).sum() / ss_tot))
+    mu, sigma, w, y, y_hat = _mod["mu"], _mod["sigma"], _mod["w"], _mod["y"], _mod["y_hat"]
+    w_boot = _mod["w_boot"]
+    alpha_r, r2, r2_loo, rmse = _mod["alpha"], _mod["r2"], _mod["r2_loo"], _mod["rmse"]
 
     # ---- Métricas ----
     st.caption(
         f"**{len(df_m)}** pares de pesadas consecutivas (≤7 días) con datos de comida · "
-        f"Sueño disponible en {n_sueño} períodos"
+        f"Sueño disponible en {n_sueño} períodos · Regularización α = {alpha_r:.3g} (GCV)"
     )
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("R² (ajuste)", f"{r2:.2f}",
@@ -858,10 +2184,9 @@ elif pagina == "Modelo":
         _sup = fp["superavit"].mean()    if not fp.empty else np.nan
         _alc = fp["kcal_alcohol"].mean() if not fp.empty else 0.0
 
-        _fases_v = [_fase((pd.Timestamp(f_ult) + pd.Timedelta(days=d)).date(), df_ciclo)
-                    for d in range(gap_p)]
-        _lut  = float(np.mean([v[2] for v in _fases_v]))
-        _mens = float(np.mean([v[1] for v in _fases_v]))
+        _fases_v = _fases(pd.date_range(pd.Timestamp(f_ult), periods=gap_p).date, df_ciclo)
+        _lut  = float(_fases_v["es_lutea"].mean())
+        _mens = float(_fases_v["es_menstrual"].mean())
 
         x_pred_map = {
             "superavit_medio": _sup  if not pd.isna(_sup)  else float(df_m["superavit_medio"].mean()),
@@ -886,6 +2211,7 @@ elif pagina == "Modelo":
         x_s   = np.concatenate([[1.0], (x_arr - mu) / sigma])
         delta_pred = float(x_s @ w)
         peso_pred  = float(ultimo_p["peso_kg"]) + delta_pred * gap_p
+        peso_lo, peso_hi = np.percentile(float(ultimo_p["peso_kg"]) + (w_boot @ x_s) * gap_p, [2.5, 97.5])
 
         pa, pb, pc = st.columns(3)
         pa.metric(
@@ -896,8 +2222,10 @@ elif pagina == "Modelo":
         pb.metric(
             "Peso estimado mañana",
             f"{peso_pred:.2f} kg",
-            f"{delta_pred * gap_p * 1000:+.0f} g"
+            f"{delta_pred * gap_p * 1000:+.0f} g",
+            help=f"Intervalo bootstrap del 95 % ({len(w_boot)} remuestreos): {peso_lo:.2f}–{peso_hi:.2f} kg"
         )
+        pb.caption(f"IC 95 %: {peso_lo:.2f}–{peso_hi:.2f} kg")
         if dias_comida == 0:
             pc.warning(f"Sin comidas desde {f_ult} — usando superávit medio histórico como base")
         elif dias_comida < dias_esperados:
@@ -910,16 +2238,105 @@ elif pagina == "Modelo":
     st.subheader("Factores de peso")
     coef_norm = w[1:]
     coef_orig = coef_norm / sigma
+    coef_lo, coef_hi = np.percentile(w_boot[:, 1:] / sigma * 1000, [2.5, 97.5], axis=0)
     df_coef = pd.DataFrame({
         "Variable": [FEAT[k] for k in feat_keys],
         "Efecto por unidad → g/día": np.round(coef_orig * 1000, 2),
+        "IC 95 % (g/día)": [f"{a:.2f} … {b:.2f}" for a, b in zip(coef_lo, coef_hi)],
         "Importancia relativa (%)":  np.round(np.abs(coef_norm) / np.abs(coef_norm).sum() * 100, 1),
     }).sort_values("Importancia relativa (%)", ascending=False).reset_index(drop=True)
     st.dataframe(df_coef, use_container_width=True)
     st.caption(
-        "Para las variables de ciclo (fracción 0–1): el efecto es el máximo al pasar el período entero en esa fase."
+        "Para las variables de ciclo (fracción 0–1): el efecto es el máximo al pasar el período entero en esa fase. "
+        "IC 95 %: intervalo bootstrap; si cruza el 0, el signo del efecto no es fiable."
     )
 
+    # ---- Simulador de escenarios ----
+    st.subheader("¿Y si…?")
+
+    @st.fragment
+    def _simulador():
+        _s1, _s2, _s3 = st.columns(3)
+        _dias = _s1.slider("Días", 7, 90, 30, key="sim_dias")
+        _alc = _s2.slider("Alcohol (kcal/día)", 0, 600, 0, step=50, key="sim_alc")
+        _sue = _s3.slider("Horas en cama", 5.0, 9.5, 7.5, step=0.5, key="sim_sue",
+                          disabled="sueño_medio" not in feat_keys)
+        _ult = df_peso.iloc[-1]
+        _gasto = df_master.loc[df_master["Fecha"] >= df_master["Fecha"].max() - timedelta(days=30), "gasto"].mean()
+        if pd.isna(_gasto):
+            _gasto = df_master["gasto"].mean()
+        _kcal = np.arange(1200, 2201, 50)
+        # Toda la rejilla (kcal × alcohol × sueño) en una pasada; los sliders solo eligen el corte
+        _esc = _escenarios(kcal=_kcal, alcohol_medio=np.arange(0, 601, 50),
+                           sueño_medio=np.arange(5.0, 9.51, 0.5))
+        _esc["superavit_medio"] = _esc["kcal"] - _gasto
+        _fv = _fases(pd.date_range(pd.Timestamp(date.today()) + pd.Timedelta(days=1), periods=_dias).date, df_ciclo)
+        _tray = _simular(_mod, _esc, _fv, float(_ult["peso_kg"]))
+        _sel = (_esc["alcohol_medio"] == _alc) & np.isclose(_esc["sueño_medio"], _sue)
+        _fechas = pd.date_range(pd.Timestamp(date.today()) + pd.Timedelta(days=1), periods=_dias)
+
+        fig_s = go.Figure()
+        for _i in np.flatnonzero(_sel.to_numpy())[::4]:
+            fig_s.add_trace(go.Scatter(
+                x=_fechas, y=_tray[_i].round(2), mode="lines",
+                name=f"{_esc.loc[_i, 'kcal']:.0f} kcal",
+            ))
+        fig_s.update_layout(yaxis_title="kg", hovermode="x unified", height=320,
+                            margin=dict(t=10, b=10, l=0, r=0))
+        st.plotly_chart(fig_s, use_container_width=True)
+
+        _fin = _esc.loc[np.isclose(_esc["sueño_medio"], _sue), ["kcal", "alcohol_medio"]].assign(
+            peso=_tray[np.isclose(_esc["sueño_medio"], _sue), -1])
+        fig_h = go.Figure(go.Heatmap(
+            x=_fin["kcal"], y=_fin["alcohol_medio"], z=_fin["peso"].round(2),
+            colorscale="RdYlGn_r", colorbar=dict(title="kg"),
+            hovertemplate="%{x} kcal · %{y} kcal alcohol → %{z} kg<extra></extra>",
+        ))
+        fig_h.update_layout(xaxis_title="kcal/día", yaxis_title="Alcohol (kcal/día)", height=300,
+                            margin=dict(t=10, b=10, l=0, r=0))
+        st.plotly_chart(fig_h, use_container_width=True)
+        st.caption(
+            f"{len(_esc)} escenarios × {_dias} días desde {float(_ult['peso_kg']):.2f} kg; "
+            f"gasto medio reciente {_gasto:.0f} kcal/día. Arriba, trayectorias con el alcohol y el sueño "
+            f"elegidos; abajo, peso al final según kcal y alcohol. Las variables no fijadas quedan en su "
+            "media histórica y las de ciclo siguen el calendario previsto."
+        )
+
+    _simulador()
+
+    _bt = _mod["backtest"]
+    if _bt is not None:
+        with st.expander("Validación temporal"):
+            st.caption(
+                f"Cada una de las últimas {_bt.attrs['n']} observaciones se predice con un modelo "
+                f"ajustado solo con las anteriores. R² fuera de muestra: **{_bt.attrs['r2']:.2f}** "
+                "(frente a predecir la media del pasado; el R² LOO usa también datos futuros)."
+            )
+            st.dataframe(pd.DataFrame({
+                "Días hasta la pesada": _bt["horizonte"],
+                "Casos": _bt["n"].fillna(0).astype(int),
+                "Error medio (g)": _bt["mae_g"].round(0),
+                "RMSE (g)": _bt["rmse_g"].round(0),
+            }), use_container_width=True, hide_index=True)
+
+    _subc = _mod["subconjuntos"]
+    if len(_subc):
+        with st.expander("Búsqueda de variables"):
+            _etq = {**FEAT_BASE, **{k: l for k, l, *_ in FEAT_OPCIONALES}}
+            _actual = _subc.index[_subc["features"].map(set) == set(feat_keys)]
+            _top = _subc.head(5)
+            st.dataframe(pd.DataFrame({
+                "Variables": [", ".join(_etq[k] for k in f) for f in _top["features"]],
+                "R² (LOO)": _top["r2_loo"].round(3),
+                "α": _top["alpha"].map(lambda a: f"{a:.3g}"),
+            }), use_container_width=True, hide_index=True)
+            st.caption(
+                f"Las {len(_subc)} combinaciones de variables candidatas, evaluadas sobre las "
+                f"{int(_subc['n'].iloc[0])} observaciones que tienen todas. "
+                + (f"La selección actual queda en el puesto {_actual[0] + 1} "
+                   f"(R² LOO {_subc.loc[_actual[0], 'r2_loo']:.3f})." if len(_actual) else "")
+            )
+
     # ---- Gráfica predicción vs real (último mes) ----
     st.subheader("Predicción vs real")
     cutoff_30 = date.today() - pd.Timedelta(days=30)
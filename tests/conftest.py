@@ -0,0 +1,53 @@
+"""main.py es un script de Streamlit: aquí se cargan sus definiciones puras sin ejecutar la app."""
+import ast
+import copy
+import pathlib
+import types
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+MAIN = pathlib.Path(__file__).resolve().parents[1] / "main.py"
+
+MODELO = ["FEAT_BASE", "FEAT_OPCIONALES", "RIDGE_ALPHAS", "BOOT_N", "SUBCONJUNTOS_CRECER", "_fase",
+          "_fases", "_observaciones", "_EstadisticosRidge", "_bootstrap_ridge", "_buscar_subconjuntos",
+          "_backtest", "_ajustar_modelo"]
+
+def cargar(*nombres, **globales):
+    """Namespace con las funciones, clases y constantes `nombres` de main.py; `globales` sustituye lo que no se carga."""
+    cuerpo = []
+    for nodo in ast.parse(MAIN.read_text(encoding="utf-8")).body:
+        if isinstance(nodo, (ast.FunctionDef, ast.ClassDef)) and nodo.name in nombres:
+            nodo.decorator_list = []
+            cuerpo.append(nodo)
+        elif isinstance(nodo, ast.Assign) and any(getattr(t, "id", None) in nombres for t in nodo.targets):
+            cuerpo.append(nodo)
+    ns = {"np": np, "pd": pd, "copy": copy, "timedelta": timedelta, **globales}
+    exec(compile(ast.Module(body=cuerpo, type_ignores=[]), str(MAIN), "exec"), ns)
+    return types.SimpleNamespace(**ns)
+
+@pytest.fixture(scope="session")
+def modelo():
+    return cargar(*MODELO)
+
+def fuentes(dias=150, sueño_desde=60, semilla=0):
+    """Las seis fuentes de _ajustar_modelo, sintéticas; el sueño solo a partir del día `sueño_desde`."""
+    rng = np.random.default_rng(semilla)
+    fechas = [date(2025, 1, 1) + timedelta(i) for i in range(dias)]
+    kcal = rng.normal(1800, 300, dias)
+    comidas = pd.DataFrame({
+        "Fecha": fechas, "hora": "21:00", "comida": np.where(rng.random(dias) < 0.1, "cerveza", "plato"),
+        "calorías_estimadas": kcal, "carbohidratos_g": rng.normal(200, 40, dias),
+        "sodio_nivel": rng.choice(["bajo", "medio", "alto"], dias),
+    })
+    basal = pd.DataFrame({"Fecha": fechas, "basal_kcal": 1300.0})
+    activo = pd.DataFrame({"Fecha": fechas, "activo_kcal": rng.normal(350, 80, dias)})
+    peso = pd.DataFrame({"Fecha": fechas,
+                         "peso_kg": 60 + np.cumsum((kcal - 1650) / 7700) + rng.normal(0, 0.2, dias)})
+    sueño = pd.DataFrame({"Fecha": fechas[sueño_desde:], "horas_cama": rng.normal(7.5, 0.6, dias - sueño_desde)})
+    ciclo = pd.DataFrame({"inicio": [date(2025, 1, 1) + timedelta(28 * k) for k in range(dias // 28 + 1)]})
+    ciclo["fin"] = [i + timedelta(27) for i in ciclo["inicio"]]
+    ciclo["dias_regla"] = 5
+    return comidas, peso, basal, activo, sueño, ciclo
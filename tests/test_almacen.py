@@ -0,0 +1,39 @@
+import threading
+import time
+from collections import deque
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+
+from conftest import cargar
+
+
+def test_dia_tras_releer_la_misma_vista_en_otro_orden():
+    filas = pd.DataFrame({
+        "id": ["a", "b", "c"],
+        "Fecha": [date(2026, 8, 15), date(2025, 3, 1), date(2026, 8, 15)],
+        "comida": ["tostada", "guiso", "ensalada"],
+        "calorías_estimadas": [100.0, 200.0, 300.0],
+    })
+    lecturas = iter([filas, filas.iloc[[1, 0, 2]].reset_index(drop=True)])
+    firmas = iter(range(10))
+    m = cargar("_AlmacenComidas", "_huella", "_recortar", "_aplicar_ops", "REVALIDAR", "VENTANA_RECIENTE",
+               threading=threading, time=time, deque=deque, date=date,
+               _firma_remota=lambda: (next(firmas), {}),
+               _leer_comidas=lambda firma, particiones, desde: (next(lecturas), None))
+    almacen = m._AlmacenComidas()
+    almacen.refrescar(forzar=True)
+    version = almacen.version
+    almacen.refrescar(forzar=True)   # p.ej. tras una compactación que mueve filas de partición
+    assert almacen.version == version
+    d, kcal = almacen.dia(date(2026, 8, 15))
+    assert sorted(d["id"]) == ["a", "c"]
+    assert kcal == 400.0
+
+
+def test_para_csv_no_sube_la_precision_de_float32():
+    m = cargar("_para_csv", "ESQUEMA_COMIDAS", "FECHA", "TEXTO", "SODIO", pa=pa)
+    d = pd.DataFrame({"carbohidratos_g": pd.array([4.8, None], dtype="float32"),
+                      "proteinas_g": pd.array([31.9, 2.0], dtype="float32").astype("float64")})
+    assert m._para_csv(d).to_csv(index=False) == "carbohidratos_g,proteinas_g\n4.8,31.9\n,2.0\n"
@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from conftest import fuentes
+
+def test_n_sueño_cuenta_periodos_antes_de_rellenar(modelo):
+    comidas, peso, basal, activo, sueño, ciclo = fuentes(sueño_desde=60)
+    res = modelo._ajustar_modelo(comidas, peso, basal, activo, sueño, ciclo)
+    crudo = modelo._observaciones(peso, res["df_master"])
+    assert res["n_sueño"] == crudo["sueño_medio"].notna().sum()
+    assert 0 < res["n_sueño"] < len(res["df_obs"])
+    assert res["df_obs"]["sueño_medio"].notna().all()   # la feature sí se rellena
+
+
+def test_reutiliza_estadisticos_al_crecer(modelo):
+    todas = fuentes(dias=130)
+    res = None
+    for dias in range(115, 131):
+        recorte = [f[f["Fecha"] < date(2025, 1, 1) + timedelta(dias)] for f in todas[:5]] + [todas[5]]
+        previo, res = res, modelo._ajustar_modelo(*recorte, previo=res)
+        if previo is not None:
+            assert res["n_previas"] == len(previo["y"])
+            assert res["rellenos"] == previo["rellenos"]
+        completo = modelo._EstadisticosRidge(len(res["feat_keys"]))
+        completo.añadir(res["X"], res["y"])
+        for k, v in vars(completo).items():
+            np.testing.assert_allclose(res["stats"][k], v, rtol=1e-9, atol=1e-6)
+    # Bootstrap y backtest ampliados día a día coinciden con los de un ajuste desde cero
+    w_boot, _ = modelo._bootstrap_ridge(res["X"], res["y"], res)
+    np.testing.assert_allclose(res["w_boot"], w_boot, rtol=1e-6, atol=1e-9)
+    backtest, _ = modelo._backtest(res["bt_estado"]["X"], res["y"], res["df_m"]["gap"].to_numpy())
+    pd.testing.assert_frame_equal(res["backtest"], backtest)
+
+
+def test_backtest_rellena_con_la_ventana_de_entrenamiento(modelo):
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(60, 3)) * [1, 300, 2] + [0, 1800, 7]
+    y = X @ [0.1, 1e-4, -0.05] + rng.normal(0, 0.05, 60)
+    X[rng.random(60) < 0.3, 2] = np.nan
+    X[40:, 2] += 5            # el futuro mueve la mediana muestral completa
+    gaps = rng.integers(1, 8, 60)
+    out, _ = modelo._backtest(X, y, gaps)
+
+    errores = []
+    for t in range(20, 60):
+        pasado = np.where(np.isnan(X[:t]), np.nanmedian(X[:t], axis=0), X[:t])
+        stats = modelo._EstadisticosRidge(3)
+        stats.añadir(pasado, y[:t])
+        fit = stats.ajustar()
+        fila = np.where(np.isnan(X[t]), np.nanmedian(X[:t], axis=0), X[t])
+        pred = fit["w"][0] + ((fila - fit["mu"]) / fit["sigma"]) @ fit["w"][1:]
+        errores.append((gaps[t], abs(pred - y[t]) * gaps[t] * 1000))
+    esperado = pd.DataFrame(errores, columns=["horizonte", "e"]).groupby("horizonte")["e"].mean()
+    np.testing.assert_allclose(out.set_index("horizonte")["mae_g"].dropna(), esperado, rtol=1e-6)
+
+
+def test_fases_coincide_con_fase_con_ciclos_solapados(modelo):
+    d = date(2025, 1, 1)
+    ciclo = pd.DataFrame({
+        "inicio": [d + timedelta(30), d, d + timedelta(20), d + timedelta(70)],
+        "fin": [d + timedelta(58), d + timedelta(40), d + timedelta(27), d + timedelta(98)],
+        "dias_regla": [5, 4, 6, 5],
+    })
+    fechas = pd.Series([d + timedelta(i) for i in range(-3, 105)])
+    esperado = pd.DataFrame([modelo._fase(f, ciclo) for f in fechas],
+                            columns=["dia_ciclo", "es_menstrual", "es_lutea"])
+    pd.testing.assert_frame_equal(modelo._fases(fechas, ciclo), esperado, check_dtype=False)